@@ -1,11 +1,37 @@
 """PhoneBook Application that saves files and implements basic Auth using hashed password"""
 
+import argparse
 import csv
+import gc
+import re
+import shlex
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass, asdict
-from typing import Dict, List
+from functools import partial
+from itertools import islice, repeat
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import os
 import hashlib
 
+from dedup import DuplicateReport, find_duplicates
+from indexes import (
+    BKTree, FacetIndex, LRUCache, PackedTextIndex, PrefixTrie, SortedIndex, TermIndex, TrigramIndex,
+    levenshtein, normalize_phone, search_key,
+)
+from phonetic import name_phonetic_keys, phonetic_keys
+from query import Predicate, QueryCatalog, QueryPlan, parse_query
+from storage import (
+    CONTACT_FIELDS, ContactStorage, CsvStorage, RowOffsetIndex, read_csv_range, read_rows,
+    split_csv_ranges, write_rows,
+)
+
 COUNTRY_CODES: Dict[str, str] = {
     # --- North America ---
     "+1": "USA/Canada",
@@ -130,6 +156,46 @@ COUNTRY_CODES: Dict[str, str] = {
 
 VALID_CATEGORIES = ["General", "Family", "Friends", "Emergency", "Favourites"]
 
+PAGE_SIZE = 20
+
+# Phone numbers are spelled out in the prefix trie this many digits deep.
+PHONE_TRIE_DEPTH = 5
+
+FACET_FIELDS = ("country", "category")
+
+# Prefix lookup table built once at import time. Every code length is tried
+# from longest to shortest, so a match costs a handful of dict lookups instead
+# of sorting the whole COUNTRY_CODES table for every contact.
+_CODE_LENGTHS: List[int] = sorted({len(code) for code in COUNTRY_CODES}, reverse=True)
+_MAX_CODE_LENGTH: int = _CODE_LENGTHS[0]
+
+
+def lookup_country(phone: str) -> str:
+    """Returns the country for the longest known prefix of the phone number."""
+    for length in _CODE_LENGTHS:
+        country = COUNTRY_CODES.get(phone[:length])
+        if country is not None:
+            return country
+    return "Unknown"
+
+
+def resolve_countries(phones: Iterable[str]) -> List[str]:
+    """
+    Resolves the country for many phone numbers in one pass.
+
+    Only the first few characters of a number decide its country, so results
+    are memoised on that prefix and repeated prefixes cost one dict lookup.
+    """
+    cache: Dict[str, str] = {}
+    countries = []
+    for phone in phones:
+        prefix = phone[:_MAX_CODE_LENGTH]
+        country = cache.get(prefix)
+        if country is None:
+            country = cache[prefix] = lookup_country(prefix)
+        countries.append(country)
+    return countries
+
 
 @dataclass
 class Contact:
@@ -139,30 +205,54 @@ class Contact:
     This class automatically handles data validation and normalization:
     - Calculates the 'country' based on the phone prefix.
     - Defaults 'category' to 'General' if an invalid one is provided.
+
+    'id' is assigned by the Phonebook when the contact is first added and
+    stays the same for the life of the contact, including across saves.
+
+    'search_key' holds the normalised name (see indexes.search_key) and is
+    recomputed whenever the name is assigned, so searches never have to
+    normalise every name again.
     """
     name: str
     phone: str
     email: str
     country: str = "Unknown"
     category: str = "General"
+    id: int = 0
 
     def __post_init__(self):
         """
         Runs automatically after initialization to normalize data.
         """
+        # Values read back from CSV arrive as strings.
+        self.id = int(self.id or 0)
+
         if self.country == "Unknown":
             self.country = self._calculate_country()
 
         if self.category not in VALID_CATEGORIES:
             self.category = "General"
 
+    def __setattr__(self, field: str, value):
+        self.__dict__[field] = value
+        if field == "name":
+            self.__dict__["search_key"] = search_key(value)
+
+    @classmethod
+    def from_trusted(cls, row: Dict) -> "Contact":
+        """
+        Builds a Contact from values that were already validated when saved,
+        skipping __post_init__. 'row' must hold every field, with an int id,
+        and is adopted as the instance's attribute dict rather than copied.
+        """
+        contact = cls.__new__(cls)
+        row["search_key"] = search_key(row["name"])
+        object.__setattr__(contact, "__dict__", row)
+        return contact
+
     def _calculate_country(self) -> str:
         """Determines country name by matching phone prefix against known codes."""
-        sorted_codes = sorted(COUNTRY_CODES.keys(), key=len, reverse=True)
-        for code in sorted_codes:
-            if self.phone.startswith(code):
-                return COUNTRY_CODES[code]
-        return "Unknown"
+        return lookup_country(self.phone)
 
     def update_phone(self, new_phone: str):
         """
@@ -175,6 +265,360 @@ class Contact:
         self.country = self._calculate_country()
 
 
+def contact_row(contact) -> Dict[str, str]:
+    """Returns the storable fields of a Contact or ContactView as a plain dict."""
+    return {field: getattr(contact, field) for field in CONTACT_FIELDS}
+
+
+class ContactView:
+    """
+    Lightweight handle to one contact inside a ContactStore.
+
+    Reads and writes go straight to the store's columns, so a view behaves
+    like a Contact without owning any of the data itself.
+    """
+    __slots__ = ("_store", "_id")
+
+    def __init__(self, store: "ContactStore", contact_id: int):
+        self._store = store
+        self._id = contact_id
+
+    id = property(lambda self: self._id)
+    name = property(lambda self: self._store.read(self._id, "name"),
+                    lambda self, value: self._store.write(self._id, "name", value))
+    phone = property(lambda self: self._store.read(self._id, "phone"),
+                     lambda self, value: self._store.write(self._id, "phone", value))
+    email = property(lambda self: self._store.read(self._id, "email"),
+                     lambda self, value: self._store.write(self._id, "email", value))
+    country = property(lambda self: self._store.read(self._id, "country"))
+    category = property(lambda self: self._store.read(self._id, "category"))
+    search_key = property(lambda self: self._store.read(self._id, "search_key"))
+
+    def update_phone(self, new_phone: str):
+        """Updates the phone number and recalculates the country, like Contact."""
+        self._store.write(self._id, "phone", new_phone)
+        self._store.write(self._id, "country", lookup_country(new_phone))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (Contact, ContactView)):
+            return NotImplemented
+        return contact_row(self) == contact_row(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in CONTACT_FIELDS)
+        return f"ContactView({fields})"
+
+
+class ContactStore(MutableMapping):
+    """
+    Columnar id -> contact mapping for very large phonebooks.
+
+    Instead of one dataclass instance (and its __dict__) per contact, the
+    fields live in parallel columns: names, phones and emails as lists of
+    strings, and country and category as small integer codes into shared
+    string tables. A name's search key is only stored when it differs from
+    the name. Lookups hand out ContactView proxies on demand.
+
+    Rows are kept in id order (the order the Phonebook hands ids out in), so
+    an id is found by bisecting a packed array rather than through a per-row
+    dict entry. Deleted rows are flagged dead and the columns are compacted
+    once more than half of the rows are dead.
+    """
+    def __init__(self):
+        self._ids = array("q")
+        self._alive = bytearray()
+        self._names: List[Optional[str]] = []
+        self._keys: List[Optional[str]] = []
+        self._phones: List[Optional[str]] = []
+        self._emails: List[Optional[str]] = []
+        self._countries = array("H")
+        self._categories = array("B")
+        self._live = 0
+        self._country_table: List[str] = []
+        self._country_codes: Dict[str, int] = {}
+        self._category_codes = {category: code for code, category in enumerate(VALID_CATEGORIES)}
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __iter__(self):
+        for slot, contact_id in enumerate(self._ids):
+            if self._alive[slot]:
+                yield contact_id
+
+    def __contains__(self, contact_id) -> bool:
+        return self._find(contact_id) is not None
+
+    def __getitem__(self, contact_id: int) -> ContactView:
+        if self._find(contact_id) is None:
+            raise KeyError(contact_id)
+        return ContactView(self, contact_id)
+
+    def __setitem__(self, contact_id: int, contact):
+        """Stores the fields of a Contact (or view) under 'contact_id'."""
+        slot = bisect_left(self._ids, contact_id)
+        if slot == len(self._ids) or self._ids[slot] != contact_id:
+            self._ids.insert(slot, contact_id)
+            self._alive.insert(slot, 0)
+            self._names.insert(slot, None)
+            self._keys.insert(slot, None)
+            self._phones.insert(slot, None)
+            self._emails.insert(slot, None)
+            self._countries.insert(slot, 0)
+            self._categories.insert(slot, 0)
+        if not self._alive[slot]:
+            self._alive[slot] = 1
+            self._live += 1
+
+        self._names[slot] = contact.name
+        self._keys[slot] = None if contact.search_key is contact.name else contact.search_key
+        self._phones[slot] = contact.phone
+        self._emails[slot] = contact.email
+        self._countries[slot] = self._country_code(contact.country)
+        self._categories[slot] = self._category_codes[contact.category]
+
+    def __delitem__(self, contact_id: int):
+        slot = self._find(contact_id)
+        if slot is None:
+            raise KeyError(contact_id)
+        self._alive[slot] = 0
+        self._names[slot] = self._keys[slot] = self._phones[slot] = self._emails[slot] = None
+        self._live -= 1
+
+        if len(self._ids) > 64 and self._live < len(self._ids) // 2:
+            self._compact()
+
+    def read(self, contact_id: int, field: str) -> str:
+        """Returns one field of a stored contact."""
+        slot = self._slot(contact_id)
+        if field == "country":
+            return self._country_table[self._countries[slot]]
+        if field == "category":
+            return VALID_CATEGORIES[self._categories[slot]]
+        if field == "search_key":
+            key = self._keys[slot]
+            return self._names[slot] if key is None else key
+        return getattr(self, "_" + field + "s")[slot]
+
+    def write(self, contact_id: int, field: str, value: str):
+        """Overwrites one field of a stored contact."""
+        slot = self._slot(contact_id)
+        if field == "country":
+            self._countries[slot] = self._country_code(value)
+        elif field == "name":
+            key = search_key(value)
+            self._names[slot] = value
+            self._keys[slot] = None if key is value else key
+        else:
+            getattr(self, "_" + field + "s")[slot] = value
+
+    def _find(self, contact_id: int) -> Optional[int]:
+        slot = bisect_left(self._ids, contact_id)
+        if slot < len(self._ids) and self._ids[slot] == contact_id and self._alive[slot]:
+            return slot
+        return None
+
+    def _slot(self, contact_id: int) -> int:
+        slot = self._find(contact_id)
+        if slot is None:
+            raise KeyError(contact_id)
+        return slot
+
+    def _country_code(self, country: str) -> int:
+        code = self._country_codes.get(country)
+        if code is None:
+            code = self._country_codes[country] = len(self._country_table)
+            self._country_table.append(country)
+        return code
+
+    def _compact(self):
+        """Drops dead rows from every column."""
+        live = [slot for slot, alive in enumerate(self._alive) if alive]
+        self._ids = array("q", (self._ids[slot] for slot in live))
+        self._alive = bytearray(b"\x01") * len(live)
+        self._names = [self._names[slot] for slot in live]
+        self._keys = [self._keys[slot] for slot in live]
+        self._phones = [self._phones[slot] for slot in live]
+        self._emails = [self._emails[slot] for slot in live]
+        self._countries = array("H", (self._countries[slot] for slot in live))
+        self._categories = array("B", (self._categories[slot] for slot in live))
+
+
+class LazyContactMap(MutableMapping):
+    """
+    id -> Contact mapping that decodes rows from a RowOffsetIndex on demand.
+
+    Nothing is parsed up front: a Contact is only built when a lookup,
+    search hit or listing page asks for it. Added, changed and deleted
+    contacts are kept in a small overlay until the next snapshot, after
+    which 'reopen' maps the new file.
+    """
+    def __init__(self, rows: RowOffsetIndex):
+        self._rows = rows
+        self._changed: Dict[int, Contact] = {}
+        self._deleted: set = set()
+
+    def __len__(self) -> int:
+        added = sum(1 for contact_id in self._changed if not self._rows.has(contact_id))
+        return len(self._rows) - len(self._deleted) + added
+
+    def __iter__(self) -> Iterator[int]:
+        for contact_id in self._rows.ids():
+            if contact_id not in self._deleted:
+                yield contact_id
+        for contact_id in list(self._changed):
+            if not self._rows.has(contact_id):
+                yield contact_id
+
+    def __contains__(self, contact_id) -> bool:
+        if contact_id in self._changed:
+            return True
+        return contact_id not in self._deleted and self._rows.has(contact_id)
+
+    def __getitem__(self, contact_id: int) -> Contact:
+        contact = self._changed.get(contact_id)
+        if contact is not None:
+            return contact
+        row = None if contact_id in self._deleted else self._rows.get(contact_id)
+        if row is None:
+            raise KeyError(contact_id)
+        return Contact(**row)
+
+    def __setitem__(self, contact_id: int, contact: Contact):
+        self._changed[contact_id] = contact
+        self._deleted.discard(contact_id)
+
+    def __delitem__(self, contact_id: int):
+        if contact_id not in self:
+            raise KeyError(contact_id)
+        self._changed.pop(contact_id, None)
+        if self._rows.has(contact_id):
+            self._deleted.add(contact_id)
+
+    def iter_rows(self) -> Iterator[Dict[str, str]]:
+        """Yields every contact as a plain row without building Contact objects."""
+        for row in self._rows.rows():
+            contact_id = row["id"]
+            if contact_id in self._changed:
+                yield contact_row(self._changed[contact_id])
+            elif contact_id not in self._deleted:
+                yield row
+        for contact_id, contact in list(self._changed.items()):
+            if not self._rows.has(contact_id):
+                yield contact_row(contact)
+
+    def max_id(self) -> int:
+        """Returns the highest id in the mapped file or the overlay."""
+        return max(self._rows.max_id(), max(self._changed, default=0))
+
+    def close(self):
+        """Unmaps the file so a new snapshot can replace it."""
+        self._rows.close()
+
+    def reopen(self, saved: bool = True):
+        """Maps the file again and, once it holds a new snapshot, drops the overlay."""
+        self._rows.open()
+        if saved:
+            self._changed.clear()
+            self._deleted.clear()
+
+
+PARALLEL_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pauses the cyclic garbage collector for the block.
+
+    Loading contacts and building indexes allocate millions of objects and
+    none of them are garbage, so pausing the collector avoids repeated
+    full-heap scans.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _parse_csv_chunk(filename: str, start: int, end: int, header: List[str]) -> List[tuple]:
+    """
+    Worker for the parallel loader: parses and validates one byte range of a
+    contacts CSV exactly like the serial path and returns the field values.
+    """
+    # Pooled workers are reused for later tasks, so the collector must be
+    # switched back on before returning.
+    with paused_gc():
+        # Blank lines parse as empty records, which the serial DictReader skips too.
+        rows = [dict(zip(header, record)) for record in read_csv_range(filename, start, end) if record]
+        unresolved = [row for row in rows if row.get("country", "Unknown") == "Unknown"]
+        for row, country in zip(unresolved, resolve_countries(r["phone"] for r in unresolved)):
+            row["country"] = country
+
+        contacts = [Contact(**row) for row in rows]
+        return [tuple(getattr(contact, field) for field in CONTACT_FIELDS) for contact in contacts]
+
+
+def load_csv_parallel(filename: str, workers: int,
+                      chunk_bytes: int = PARALLEL_CHUNK_BYTES) -> List[Contact]:
+    """
+    Parses a contacts CSV across a process pool.
+
+    The file is split at row boundaries into chunks of about
+    'chunk_bytes', but into at least one chunk per worker. Each chunk is
+    parsed and validated in a worker, and the results are merged back in
+    file order, so the contacts are the same as those built by the serial
+    loader.
+    """
+    parts = max(workers, os.path.getsize(filename) // chunk_bytes)
+    header, ranges = split_csv_ranges(filename, parts)
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+
+    contacts = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(_parse_csv_chunk, repeat(filename), starts, ends, repeat(header))
+        for chunk in chunks:
+            contacts.extend(Contact.from_trusted(dict(zip(CONTACT_FIELDS, values))) for values in chunk)
+    return contacts
+
+
+def _scan_partition(predicate: Callable[[Dict[str, str]], bool], rows: List[Dict[str, str]]) -> List[int]:
+    """Worker for Phonebook.scan_contacts: the positions of the rows matching 'predicate'."""
+    return [position for position, row in enumerate(rows) if predicate(row)]
+
+
+def _field_matches(pattern: "re.Pattern", field: str, row: Dict[str, str]) -> bool:
+    return pattern.search(row[field]) is not None
+
+
+def field_matches(pattern: str, field: str = "name", flags: int = re.IGNORECASE) -> Callable[[Dict[str, str]], bool]:
+    """
+    Returns a predicate for Phonebook.scan_contacts that is true for rows
+    whose 'field' matches the regular expression. It can be pickled, so it
+    also works with a process pool.
+    """
+    return partial(_field_matches, re.compile(pattern, flags), field)
+
+
+@dataclass
+class ImportSummary:
+    """Counts reported by Phonebook.import_contacts."""
+    imported: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+
+
+def _duplicate_key(row: Dict[str, str]) -> int:
+    """Hash of the fields that make two imported rows the same contact."""
+    return hash((row["name"].strip().casefold(), row["phone"].strip(), (row.get("email") or "").strip().casefold()))
+
+
 @dataclass
 class User:
     """
@@ -249,54 +693,795 @@ class Phonebook:
     """
     The Controller for contact data.
     
-    Manages the lifecycle (CRUD) of contacts and handles 
-    persistence to the CSV file.
+    Manages the lifecycle (CRUD) of contacts and hands persistence to a
+    ContactStorage backend (the CSV file by default).
+
+    Contacts are held in a dict keyed by their stable 'id'. Dicts keep
+    insertion order and delete in O(1) by leaving a tombstone that is
+    compacted on resize, so delete and update never scan the book. With
+    'columnar' enabled a ContactStore is used instead, which keeps the same
+    interface but stores the fields column-wise and hands out ContactViews.
+
+    In journal mode every mutation is appended to a small log next to the CSV
+    instead of rewriting the whole file. Once 'compact_threshold' records have
+    piled up the log is folded back into a fresh CSV snapshot.
+
+    With 'trigram_index' enabled, name searches of 3+ characters are answered
+    from an inverted trigram index instead of a scan. Name changes must go
+    through 'update_contact' to keep the index current.
+
+    A name-ordered index is built on the first 'list_contacts' and maintained
+    from then on, so later pages come in name order without sorting the book.
+
+    'packed_search' keeps every name's search key in one byte buffer that
+    substring searches sweep with bytes.find (see PackedTextIndex); it needs
+    no per-trigram postings, and queries of any length benefit.
+
+    Name searches of a resident book are remembered in an LRU cache of
+    'search_cache_size' queries (see 'search_cache' for hit and miss
+    counts); every mutation invalidates it.
+
+    'load_workers' > 1 parses a large CSV book across that many processes
+    (see load_csv_parallel); the loaded contacts are identical either way.
+
+    With 'lazy' enabled a CSV book is memory-mapped instead of loaded, and
+    contacts are decoded only when touched (see LazyContactMap). Startup then
+    costs the same for any book size; the trigram index is not available.
+
+    A non-resident 'storage' such as SqliteStorage or ShardedStorage keeps the
+    contacts on disk; reads and searches are then answered by the backend.
     """
-    def __init__(self, filename: str):
-        self.filename = filename
-        self.contacts: List[Contact] = []
+    def __init__(self, filename: str, journal: bool = False, compact_threshold: int = 1000,
+                 trigram_index: bool = False, storage: ContactStorage = None,
+                 columnar: bool = False, lazy: bool = False, load_workers: int = 0,
+                 search_cache_size: int = 128, packed_search: bool = False):
+        self.storage = storage or CsvStorage(filename, journal, compact_threshold)
+        self.filename = self.storage.filename
+        self.load_workers = load_workers
+        self.lazy = lazy and type(self.storage) is CsvStorage
+        if self.lazy:
+            self._contacts: MutableMapping = LazyContactMap(RowOffsetIndex(self.filename))
+        else:
+            self._contacts = ContactStore() if columnar else {}
+        self._next_id = 1
+        use_trigrams = trigram_index and self.storage.resident and not self.lazy
+        self.name_index = TrigramIndex() if use_trigrams else None
+        use_packed = packed_search and self.storage.resident and not self.lazy
+        self.packed_names = PackedTextIndex() if use_packed else None
+        self.sorted_names: Optional[SortedIndex] = None
+        self.fuzzy_index: Optional[BKTree] = None
+        self.phonetic_index: Optional[TermIndex] = None
+        self.phone_index: Optional[TermIndex] = None
+        self.phone_prefixes: Optional[PrefixTrie] = None
+        self.facets: Optional[FacetIndex] = None
+        self.search_cache = LRUCache(search_cache_size)
+        self._batch_depth = 0
+        self._unsaved = False
         self.load_contacts()
 
-    def add_contact(self, contact: Contact):
-        """Adds a new contact to the list and saves immediately."""
-        self.contacts.append(contact)
-        self.save_contacts()
+    @property
+    def contacts(self) -> List[Contact]:
+        """All contacts in insertion order."""
+        if self.storage.resident:
+            return list(self._contacts.values())
+        return [Contact(**row) for row in self.storage.load_rows()]
+
+    def get_contact(self, contact_id: int) -> Optional[Contact]:
+        """Returns the contact with the given id, or None."""
+        if self.storage.resident:
+            return self._contacts.get(contact_id)
+        row = self.storage.get_row(contact_id)
+        return Contact(**row) if row else None
+
+    def add_contact(self, contact: Contact) -> Contact:
+        """
+        Adds a new contact to the list and saves immediately. Returns the
+        stored contact, which is a copy when 'contact' already had an id
+        (see _adopt).
+        """
+        contact = self._adopt(contact)
+        if self.storage.resident:
+            self._contacts[contact.id] = contact
+            self._index_contact(contact)
+        self._commit("add", contact_row(contact))
+        return contact
+
+    def import_contacts(self, source, batch_size: int = 10000) -> "ImportSummary":
+        """
+        Streams contacts in from a CSV / JSON Lines file or any iterable of
+        row dicts or Contacts.
+
+        Rows are validated, country-resolved and added 'batch_size' at a time,
+        and the book is written once at the end. Rows without a name or phone
+        are rejected, and rows whose (name, phone, email) match a contact
+        already in the book or earlier in the import are skipped. Only a hash
+        of each key is remembered, so memory for deduplication stays small.
+        Ids in the source are ignored; imported contacts get fresh ones.
+        """
+        if isinstance(source, str):
+            rows = read_rows(source)
+        else:
+            rows = (item if isinstance(item, dict) else contact_row(item) for item in source)
+
+        summary = ImportSummary()
+        seen = {_duplicate_key(row) for row in self._iter_rows()}
+        with self.batch():
+            for chunk in iter(lambda: list(islice(rows, batch_size)), []):
+                valid = [row for row in chunk if row.get("name") and row.get("phone")]
+                summary.rejected += len(chunk) - len(valid)
+
+                fresh = []
+                for row, country in zip(valid, resolve_countries(row["phone"] for row in valid)):
+                    key = _duplicate_key(row)
+                    if key in seen:
+                        summary.duplicates += 1
+                        continue
+                    seen.add(key)
+                    # JSON Lines rows may hold null for an optional field.
+                    if row.get("country") in (None, "", "Unknown"):
+                        row = {**row, "country": country}
+                    fresh.append(Contact(
+                        row["name"], row["phone"], row.get("email") or "",
+                        country=row["country"], category=row.get("category") or "General",
+                    ))
+
+                self._add_many(fresh)
+                summary.imported += len(fresh)
+        return summary
+
+    def export_contacts(self, path: str, file_format: str = "csv") -> int:
+        """
+        Writes every contact to 'path' as "csv" or "jsonl", one row at a time.
+        Returns the number of contacts written.
+        """
+        return write_rows(path, self._iter_rows(), file_format)
 
     def search_contacts(self, query: str) -> List[Contact]:
         """
         Returns a list of contacts where the name matches the query.
-        The search is case-insensitive.
+        The search ignores case, accents and repeated whitespace.
+        """
+        needle = search_key(query)
+        if not self.storage.resident:
+            return [Contact(**row) for row in self.storage.search_rows(needle)]
+
+        # Every mutation clears the cache, so a cached result is always current.
+        hits = self.search_cache.get(needle)
+        if hits is None:
+            hits = self._search_ids(needle)
+            self.search_cache.put(needle, hits)
+        return [self._contacts[contact_id] for contact_id in hits]
+
+    def iter_search(self, query: str, limit: int = None, offset: int = 0) -> Iterator[Contact]:
+        """
+        Yields the contacts search_contacts would return, lazily: 'offset'
+        matches are skipped and the search stops after 'limit' more, so a
+        scan only reads as far into the book as the page it was asked for.
+        """
+        needle = search_key(query)
+        stop = None if limit is None else offset + limit
+        if not self.storage.resident:
+            for row in islice(self.storage.search_rows(needle), offset, stop):
+                yield Contact(**row)
+            return
+
+        # Only a peek: partial results are never stored, so this is not a miss to tune for.
+        hits = self.search_cache.peek(needle)
+        if hits is None:
+            hits = self._iter_search_ids(needle)
+        for contact_id in islice(hits, offset, stop):
+            yield self._contacts[contact_id]
+
+    def first_match(self, query: str) -> Optional[Contact]:
+        """Returns the first contact search_contacts would return, or None, without finding the rest."""
+        return next(self.iter_search(query, limit=1), None)
+
+    def fuzzy_search(self, query: str, max_distance: int = 2, limit: int = 10) -> List[Contact]:
+        """
+        Returns up to 'limit' contacts whose name is within 'max_distance'
+        edits of the query, closest first. Names are compared by search key,
+        so case, accents and repeated whitespace do not count as edits.
+
+        The BK-tree behind it is built on the first fuzzy search and kept up
+        to date from then on; a non-resident book is scanned instead.
         """
-        results = []
-        for contact in self.contacts:
-            if query.lower() in contact.name.lower():
-                results.append(contact)
-        return results
+        needle = search_key(query)
+        if not self.storage.resident:
+            scored = []
+            for row in self.storage.load_rows():
+                name = search_key(row["name"])
+                if abs(len(name) - len(needle)) <= max_distance:
+                    distance = levenshtein(needle, name)
+                    if distance <= max_distance:
+                        scored.append((distance, row))
+            scored.sort(key=lambda hit: hit[0])
+            return [Contact(**row) for _, row in scored[:limit]]
+
+        if self.fuzzy_index is None:
+            with paused_gc():
+                self.fuzzy_index = BKTree()
+                for row in self._iter_rows():
+                    self.fuzzy_index.add(row["id"], search_key(row["name"]))
+
+        hits = self.fuzzy_index.search(needle, max_distance)[:limit]
+        return [self._contacts[contact_id] for _, contact_id in hits]
+
+    def sounds_like(self, query: str) -> List[Contact]:
+        """
+        Returns contacts whose name sounds like the query: every word of the
+        query must share a Soundex or Double Metaphone key with some word of
+        the name.
+
+        The keys of every name are computed once, when the index is built on
+        the first lookup, and kept up to date from then on; a non-resident
+        book is scanned instead.
+        """
+        groups = [phonetic_keys(word) for word in query.split()]
+        groups = [group for group in groups if group]
+        if not groups:
+            return []
+
+        if not self.storage.resident:
+            return [
+                Contact(**row) for row in self.storage.load_rows()
+                if all(group & name_phonetic_keys(row["name"]) for group in groups)
+            ]
+
+        if self.phonetic_index is None:
+            with paused_gc():
+                self.phonetic_index = TermIndex()
+                for row in self._iter_rows():
+                    self.phonetic_index.add(row["id"], name_phonetic_keys(row["name"]))
+
+        return [self._contacts[contact_id] for contact_id in self.phonetic_index.search(groups)]
+
+    def find_by_phone(self, number: str, prefix: bool = False) -> List[Contact]:
+        """
+        Returns the contacts whose phone number is 'number', comparing
+        normalised digits so formatting does not matter. With 'prefix' set,
+        returns the contacts whose number starts with those digits instead,
+        ordered by number.
+
+        Both indexes are built on the first lookup and kept up to date from
+        then on; a non-resident book asks its storage instead.
+        """
+        digits = normalize_phone(number)
+        if not digits:
+            return []
+
+        if not self.storage.resident:
+            return [Contact(**row) for row in self.storage.phone_rows(digits, prefix)]
+
+        phone_index, phone_prefixes = self._phone_indexes()
+        if prefix:
+            hits = phone_prefixes.iter_keys(digits)
+        else:
+            hits = phone_index.search([(digits,)])
+        return [self._contacts[contact_id] for contact_id in hits]
+
+    def filter_contacts(self, country: str = None, category: str = None) -> List[Contact]:
+        """
+        Returns the contacts in the given country and/or category, e.g. every
+        "Emergency" contact in "Portugal". Omitted fields match anything.
+        """
+        criteria = {field: value for field, value in (("country", country), ("category", category)) if value}
+        if not self.storage.resident:
+            return [Contact(**row) for row in self.storage.filter_rows(criteria)]
+        return [self._contacts[contact_id] for contact_id in self._facet_index().filter(criteria)]
+
+    def facet_counts(self) -> Dict[str, Dict[str, int]]:
+        """Returns the number of contacts per country and per category, most common first."""
+        if not self.storage.resident:
+            return {field: self.storage.count_rows(field) for field in FACET_FIELDS}
+        facets = self._facet_index()
+        return {field: facets.counts(field) for field in FACET_FIELDS}
+
+    def find_duplicates(self) -> DuplicateReport:
+        """
+        Finds clusters of contacts that look like the same person: at least
+        two of name (spelling or sound), phone digits and email agree.
+        Only contacts sharing a phone, email or name-sound block are compared.
+        """
+        with paused_gc():
+            return find_duplicates(self._iter_rows(), normalize_phone)
+
+    def merge_duplicates(self, clusters: Iterable[Iterable[int]]) -> int:
+        """
+        Merges each cluster of ids into its oldest contact (the lowest id),
+        which takes a missing email from the others before they are deleted.
+        Returns the number of contacts removed.
+        """
+        removed = 0
+        with self.batch():
+            for ids in clusters:
+                contacts = [contact for contact in map(self.get_contact, sorted(ids)) if contact is not None]
+                if len(contacts) < 2:
+                    continue
+                survivor, *others = contacts
+                email = next((contact.email for contact in others if contact.email), "")
+                if not survivor.email and email:
+                    self.update_contact(survivor, email=email)
+                for contact in others:
+                    self.delete_contact(contact)
+                removed += len(others)
+        return removed
+
+    def scan_contacts(self, predicate: Callable[[Dict[str, str]], bool], limit: int = None,
+                      workers: int = 0, processes: bool = False,
+                      partition_size: int = 10000) -> List[Contact]:
+        """
+        Returns the contacts whose row satisfies 'predicate', in book order.
+
+        This is for searches no index can answer, such as regular
+        expressions (see field_matches). The book is cut into partitions of
+        'partition_size' rows that a pool of 'workers' threads evaluates, or
+        processes with 'processes' set, which suits CPU-bound predicates but
+        needs them to be picklable. Results are gathered in partition order,
+        and no further partitions are handed out once 'limit' matches have
+        been found.
+        """
+        rows = self._iter_rows()
+        partitions = iter(lambda: list(islice(rows, partition_size)), [])
+        hits: List[Dict[str, str]] = []
+
+        def found_enough() -> bool:
+            return limit is not None and len(hits) >= limit
+
+        if workers <= 1:
+            for partition in partitions:
+                hits.extend(partition[position] for position in _scan_partition(predicate, partition))
+                if found_enough():
+                    break
+        else:
+            executor_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with executor_type(max_workers=workers) as executor:
+                # Keep a couple of partitions queued per worker, so memory stays
+                # bounded and a reached limit stops the scan early.
+                pending = deque()
+                for partition in partitions:
+                    pending.append((partition, executor.submit(_scan_partition, predicate, partition)))
+                    if len(pending) < 2 * workers:
+                        continue
+                    partition, future = pending.popleft()
+                    hits.extend(partition[position] for position in future.result())
+                    if found_enough():
+                        break
+                while pending and not found_enough():
+                    partition, future = pending.popleft()
+                    hits.extend(partition[position] for position in future.result())
+                for _, future in pending:
+                    future.cancel()
+
+        if not self.storage.resident:
+            return [Contact(**row) for row in hits[:limit]]
+        return [self._contacts[row["id"]] for row in hits[:limit]]
+
+    def query(self, text: str) -> List[Contact]:
+        """
+        Runs a query in the contact query language, e.g.
+        'category = Emergency AND country = Portugal ORDER BY name LIMIT 10'
+        (see query.py). Raises QuerySyntaxError for a malformed query.
+        """
+        return QueryPlan(parse_query(text), _PhonebookCatalog(self)).execute()
+
+    def explain(self, text: str) -> str:
+        """Describes how 'query' would run a query: the index or scan chosen and its estimated cost."""
+        return QueryPlan(parse_query(text), _PhonebookCatalog(self)).explain()
+
+    def list_contacts(self, offset: int = 0, limit: int = None, prefix: str = "") -> Iterator[Contact]:
+        """
+        Yields contacts sorted by name, lazily.
+
+        Starts 'offset' contacts past the first name beginning with 'prefix'
+        (case-sensitive) and stops after 'limit' contacts or the last match.
+        """
+        if not self.storage.resident:
+            for row in self.storage.list_rows(offset, limit, prefix):
+                yield Contact(**row)
+            return
+
+        if self.sorted_names is None:
+            with paused_gc():
+                self.sorted_names = SortedIndex()
+                self.sorted_names.add_many((row["id"], row["name"]) for row in self._iter_rows())
+
+        for contact_id in islice(self.sorted_names.iter_keys(offset, prefix), limit):
+            yield self._contacts[contact_id]
+
+    def update_contact(self, contact: Contact, name: str = None, phone: str = None,
+                       email: str = None):
+        """
+        Changes the given fields of a contact and saves the change.
+        Phone changes go through 'update_phone' so the country stays correct.
+
+        The contact is looked up by id and only the given fields of the
+        stored record change, so a stale copy (stores like ContactStore copy
+        fields on add) cannot undo other edits or mislead the indexes. The
+        caller's object gets the same changes. A contact that is no longer
+        in the book is left untouched, so a stale reference cannot bring a
+        deleted contact back.
+        """
+        stored = self._stored(contact.id)
+        if stored is None:
+            return
+
+        before = contact_row(stored)
+        for target in (stored,) if stored is contact else (stored, contact):
+            if name is not None:
+                target.name = name
+            if phone is not None:
+                target.update_phone(phone)
+            if email is not None:
+                target.email = email
+        if self.storage.resident:
+            # Write back for stores that hand out copies rather than the stored object.
+            self._contacts[stored.id] = stored
+            self._reindex_contact(stored, before)
+        self._commit("update", contact_row(stored))
 
     def delete_contact(self, contact: Contact):
-        """Removes a specific contact object from the list and updates the file."""
-        if contact in self.contacts:
-            self.contacts.remove(contact)
-            self.save_contacts()
+        """Removes the contact with this contact's id and updates the file."""
+        if not self.storage.resident:
+            self._commit("delete", contact_row(contact))
+            return
+
+        stored = self._stored(contact.id)
+        if stored is not None:
+            # The stored fields say where the contact sits in the indexes.
+            row = contact_row(stored)
+            self._unindex_contact(stored)
+            del self._contacts[stored.id]
+            self._commit("delete", row)
 
     def save_contacts(self):
-        """Writes the current list of contacts to the CSV file."""
-        with open(self.filename, mode="w", newline="", encoding="UTF-8") as file:
-            fieldnames = ["name", "phone", "country", "email", "category"]
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            for contact in self.contacts:
-                writer.writerow(asdict(contact))
+        """Writes the current list of contacts as a fresh snapshot."""
+        if not self.storage.resident:
+            return
+        if not self.lazy:
+            self.storage.save_rows(self._iter_rows())
+            return
+
+        # The rows come from the mapped CSV, so it may only be unmapped once
+        # the new snapshot is written, and must be before it is replaced.
+        temp_filename = self.storage.write_snapshot(self._iter_rows())
+        self._contacts.close()
+        try:
+            self.storage.install_snapshot(temp_filename)
+        except OSError:
+            self._contacts.reopen(saved=False)
+            raise
+        self._contacts.reopen()
+
+    def compact(self):
+        """Folds any journalled mutations into a fresh snapshot."""
+        self.save_contacts()
 
     def load_contacts(self):
-        """Reads contacts from the CSV file into memory."""
-        if not os.path.exists(self.filename):
+        """Reads contacts from storage into memory, then replays any journal."""
+        if not self.storage.resident:
+            self._next_id = self.storage.max_id() + 1
             return
 
-        with open(self.filename, mode="r", encoding="UTF-8") as file:
-            reader = csv.DictReader(file)
-            for line in reader:
-                self.contacts.append(Contact(**line))
+        if self.lazy:
+            self._next_id = self._contacts.max_id() + 1
+            self._replay_journal()
+            return
+
+        with paused_gc():
+            self._load_resident()
+
+    def _load_resident(self):
+        """Builds the in-memory contacts and indexes from a resident storage."""
+        parallel = (
+            self.load_workers > 1
+            and type(self.storage) is CsvStorage
+            and os.path.exists(self.filename)
+            and os.path.getsize(self.filename) > PARALLEL_CHUNK_BYTES
+        )
+        if parallel:
+            contacts = load_csv_parallel(self.filename, self.load_workers)
+        else:
+            contacts = self._contacts_from_rows(list(self.storage.load_rows()))
+
+        for contact in contacts:
+            # Files written before ids existed get them assigned in file order.
+            if not contact.id or contact.id in self._contacts:
+                contact.id = self._next_id
+            self._next_id = max(self._next_id, contact.id + 1)
+            self._contacts[contact.id] = contact
+
+        self._replay_journal()
+        self._index_many(self._contacts.values())
+
+    def _contacts_from_rows(self, rows: List[Dict[str, str]]) -> List[Contact]:
+        """Validates loaded rows into Contacts, unless the storage is trusted."""
+        if self.storage.trusted:
+            # Rows the backend wrote itself were validated when they were saved.
+            contacts = [Contact.from_trusted(row) for row in rows]
+        else:
+            # Resolve all missing countries in one batch instead of once per Contact.
+            unresolved = [row for row in rows if row.get("country", "Unknown") == "Unknown"]
+            for row, country in zip(unresolved, resolve_countries(r["phone"] for r in unresolved)):
+                row["country"] = country
+            contacts = [Contact(**line) for line in rows]
+        return contacts
+
+    @contextmanager
+    def batch(self):
+        """
+        Defers persistence of resident contacts until the block ends.
+
+        Inside the block mutations only change memory; a single snapshot is
+        written on exit, so thousands of edits cost one file write. A
+        non-resident storage is flushed once on exit instead.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and not self.storage.resident:
+                self.storage.flush()
+            elif not self._batch_depth and self._unsaved:
+                self.save_contacts()
+                self._unsaved = False
+
+    def _search_ids(self, needle: str) -> Tuple[int, ...]:
+        """Returns the ids of contacts whose name's search key contains 'needle'."""
+        if self.packed_names is not None and self.name_index is None:
+            # A complete answer may hold many hits, which search() gathers in one pass.
+            return tuple(self.packed_names.search(needle))
+        return tuple(self._iter_search_ids(needle))
+
+    def _iter_search_ids(self, needle: str) -> Iterator[int]:
+        """Yields the ids of contacts whose name's search key contains 'needle', in search order."""
+        if self.name_index is not None:
+            hits = self.name_index.search(needle)
+            if hits is not None:
+                return iter(hits)
+
+        if self.packed_names is not None:
+            return self.packed_names.iter_search(needle)
+
+        if self.lazy:
+            return (row["id"] for row in self._contacts.iter_rows() if needle in search_key(row["name"]))
+
+        return (contact.id for contact in self._contacts.values() if needle in contact.search_key)
+
+    def _phone_indexes(self) -> Tuple[TermIndex, PrefixTrie]:
+        """Returns the exact and prefix phone indexes, building them on first use."""
+        if self.phone_index is None:
+            with paused_gc():
+                self.phone_index, self.phone_prefixes = TermIndex(), PrefixTrie(PHONE_TRIE_DEPTH)
+                for row in self._iter_rows():
+                    phone = normalize_phone(row["phone"])
+                    self.phone_index.add(row["id"], (phone,))
+                    self.phone_prefixes.add(row["id"], phone)
+        return self.phone_index, self.phone_prefixes
+
+    def _facet_index(self) -> FacetIndex:
+        """Returns the country/category index, building it on first use."""
+        if self.facets is None:
+            with paused_gc():
+                self.facets = FacetIndex(FACET_FIELDS)
+                for row in self._iter_rows():
+                    self.facets.add(row["id"], row)
+        return self.facets
+
+    def _adopt(self, contact) -> Contact:
+        """
+        Returns the Contact to store for a new contact, with its id assigned.
+
+        A contact without an id is adopted and numbered in place. One that
+        already has an id may be held by this or another book, so a copy is
+        stored instead and the caller's object is never renumbered; the copy
+        keeps the id if it is unused in a resident book.
+        """
+        if contact.id:
+            free = self.storage.resident and contact.id not in self._contacts
+            contact = Contact.from_trusted({**contact_row(contact), "id": contact.id if free else self._next_id})
+        else:
+            contact.id = self._next_id
+        self._next_id = max(self._next_id, contact.id + 1)
+        return contact
+
+    def _add_many(self, contacts: List[Contact]):
+        """Adds several new contacts, indexing and persisting them in bulk."""
+        contacts = [self._adopt(contact) for contact in contacts]
+        if not self.storage.resident:
+            self.storage.record_many("add", [contact_row(contact) for contact in contacts])
+            if not self._batch_depth:
+                self.storage.flush()
+            return
+
+        for contact in contacts:
+            self._contacts[contact.id] = contact
+        self._index_many(contacts)
+        for contact in contacts:
+            self._commit("add", contact_row(contact))
+
+    def _iter_rows(self) -> Iterator[Dict[str, str]]:
+        """Yields every contact as a plain row, without loading a non-resident book."""
+        if self.lazy:
+            return self._contacts.iter_rows()
+        if self.storage.resident:
+            return (contact_row(contact) for contact in self._contacts.values())
+        return self.storage.load_rows()
+
+    def _commit(self, op: str, row: Dict[str, str]):
+        """Persists one mutation and writes a snapshot when the storage asks for one."""
+        self.search_cache.clear()
+        if self._batch_depth and self.storage.resident:
+            self._unsaved = True
+            return
+
+        self.storage.record(op, row)
+        if not self.storage.resident:
+            if not self._batch_depth:
+                self.storage.flush()
+        elif self.storage.snapshot_due():
+            self.save_contacts()
+
+    def _index_many(self, contacts: Iterable[Contact]):
+        """Adds contacts to every in-memory index, using their current field values."""
+        contacts = list(contacts)
+        if self.sorted_names is not None:
+            self.sorted_names.add_many((contact.id, contact.name) for contact in contacts)
+        if self.name_index is not None:
+            for contact in contacts:
+                self.name_index.add(contact.id, contact.search_key)
+        if self.packed_names is not None:
+            self.packed_names.add_many((contact.id, contact.search_key) for contact in contacts)
+        if self.fuzzy_index is not None:
+            for contact in contacts:
+                self.fuzzy_index.add(contact.id, contact.search_key)
+        if self.phonetic_index is not None:
+            for contact in contacts:
+                self.phonetic_index.add(contact.id, name_phonetic_keys(contact.name))
+        if self.facets is not None:
+            for contact in contacts:
+                self.facets.add(contact.id, contact_row(contact))
+        if self.phone_index is not None:
+            for contact in contacts:
+                self.phone_index.add(contact.id, (normalize_phone(contact.phone),))
+                self.phone_prefixes.add(contact.id, normalize_phone(contact.phone))
+
+    def _index_contact(self, contact: Contact):
+        """Adds one contact to every in-memory index."""
+        self._index_many((contact,))
+
+    def _stored(self, contact_id: int) -> Optional[Contact]:
+        """Returns the book's current record of a contact, or None if it is not in the book."""
+        if self.storage.resident:
+            return self._contacts.get(contact_id)
+        row = self.storage.get_row(contact_id)
+        return Contact.from_trusted(dict(row)) if row else None
+
+    def _reindex_contact(self, contact: Contact, before: Dict[str, str]):
+        """
+        Brings the indexes over a contact's changed fields up to date. The
+        indexes replace its entries in place, so an edited contact keeps its
+        place in search results.
+        """
+        if contact.name != before["name"]:
+            if self.sorted_names is not None:
+                self.sorted_names.remove(contact.id, before["name"])
+                self.sorted_names.add(contact.id, contact.name)
+            if self.name_index is not None:
+                self.name_index.add(contact.id, contact.search_key)
+            if self.packed_names is not None:
+                self.packed_names.add(contact.id, contact.search_key)
+            if self.fuzzy_index is not None:
+                self.fuzzy_index.add(contact.id, contact.search_key)
+            if self.phonetic_index is not None:
+                self.phonetic_index.add(contact.id, name_phonetic_keys(contact.name))
+
+        if contact.phone != before["phone"] and self.phone_index is not None:
+            self.phone_index.add(contact.id, (normalize_phone(contact.phone),))
+            self.phone_prefixes.remove(contact.id, normalize_phone(before["phone"]))
+            self.phone_prefixes.add(contact.id, normalize_phone(contact.phone))
+
+        row = contact_row(contact)
+        if self.facets is not None and any(row[field] != before[field] for field in FACET_FIELDS):
+            self.facets.add(contact.id, row)
+
+    def _unindex_contact(self, contact: Contact):
+        """Removes a contact from the indexes, using its current field values."""
+        if self.sorted_names is not None:
+            self.sorted_names.remove(contact.id, contact.name)
+        if self.name_index is not None:
+            self.name_index.remove(contact.id)
+        if self.packed_names is not None:
+            self.packed_names.remove(contact.id)
+        if self.fuzzy_index is not None:
+            self.fuzzy_index.remove(contact.id)
+        if self.phonetic_index is not None:
+            self.phonetic_index.remove(contact.id)
+        if self.facets is not None:
+            self.facets.remove(contact.id)
+        if self.phone_index is not None:
+            self.phone_index.remove(contact.id)
+            self.phone_prefixes.remove(contact.id, normalize_phone(contact.phone))
+
+    def _replay_journal(self):
+        """Applies the logged mutations on top of the loaded snapshot."""
+        for op, row in self.storage.replay():
+            contact = Contact(**row)
+            if op == "delete":
+                self._contacts.pop(contact.id, None)
+            else:
+                self._contacts[contact.id] = contact
+            self._next_id = max(self._next_id, contact.id + 1)
+
+
+class _PhonebookCatalog(QueryCatalog):
+    """
+    Tells the query planner about a Phonebook: phone predicates use the
+    phone indexes, country and category equality the facet index, and name
+    substrings the trigram index or packed name buffer when enabled. The
+    phone and facet indexes are built on first use, like their lookups.
+    """
+    # A bytes.find sweep over the packed names costs a fraction of a Python scan.
+    PACKED_SCAN_FACTOR = 20
+
+    def __init__(self, phonebook: Phonebook):
+        self.phonebook = phonebook
+
+    def size(self) -> int:
+        if self.phonebook.storage.resident:
+            return len(self.phonebook._contacts)
+        return self.phonebook.storage.max_id()
+
+    def records(self, ids: Iterable[int] = None) -> Iterator[Contact]:
+        phonebook = self.phonebook
+        if ids is None:
+            if phonebook.storage.resident:
+                return iter(phonebook._contacts.values())
+            return (Contact(**row) for row in phonebook.storage.load_rows())
+        return filter(None, map(phonebook.get_contact, sorted(ids)))
+
+    def normalize(self, field: str, value: str) -> str:
+        return normalize_phone(value) if field == "phone" else search_key(value)
+
+    def record_key(self, record, field: str) -> str:
+        if field == "name":
+            return record.search_key
+        return self.normalize(field, getattr(record, field))
+
+    def estimate(self, predicate: Predicate) -> Optional[Tuple[str, int]]:
+        phonebook = self.phonebook
+        if not phonebook.storage.resident:
+            return None
+
+        if predicate.field == "phone" and predicate.op == "=":
+            return "phone", len(phonebook._phone_indexes()[0].search([(predicate.value,)]))
+        if predicate.field == "phone" and predicate.op == "prefix":
+            # Each leading digit narrows the numbers about tenfold.
+            return "phone prefix trie", max(1, self.size() // 10 ** min(len(predicate.value), 6))
+        if predicate.field in FACET_FIELDS and predicate.op == "=":
+            counts = phonebook._facet_index().counts(predicate.field)
+            return "facets", sum(count for value, count in counts.items() if search_key(value) == predicate.value)
+        if predicate.field == "name" and predicate.op in ("contains", "prefix"):
+            if phonebook.name_index is not None and phonebook.name_index.estimate(predicate.value) is not None:
+                return "trigram", phonebook.name_index.estimate(predicate.value)
+            if phonebook.packed_names is not None:
+                return "packed names", self.size() // self.PACKED_SCAN_FACTOR
+        return None
+
+    def lookup(self, predicate: Predicate) -> Iterable[int]:
+        phonebook = self.phonebook
+        if predicate.field == "phone":
+            phone_index, phone_prefixes = phonebook._phone_indexes()
+            if predicate.op == "prefix":
+                return phone_prefixes.iter_keys(predicate.value)
+            return phone_index.search([(predicate.value,)])
+        if predicate.field in FACET_FIELDS:
+            facets = phonebook._facet_index()
+            values = [value for value in facets.counts(predicate.field) if search_key(value) == predicate.value]
+            return [key for value in values for key in facets.filter({predicate.field: value})]
+        if phonebook.name_index is not None and phonebook.name_index.estimate(predicate.value) is not None:
+            return phonebook.name_index.search(predicate.value)
+        return phonebook.packed_names.search(predicate.value)
 
 
 def attempt_login(auth: Authenticator) -> bool:
@@ -355,8 +1540,11 @@ def search_contact(phonebook: Phonebook):
     matches = phonebook.search_contacts(query)
 
     if not matches:
-        print("No contacts found.")
-        return
+        matches = phonebook.sounds_like(query)
+        if not matches:
+            print("No contacts found.")
+            return
+        print("No exact match. Contacts with a similar sounding name:")
 
     print(f"\nFound {len(matches)} result(s)")
     for contact in matches:
@@ -364,17 +1552,26 @@ def search_contact(phonebook: Phonebook):
 
 
 def handle_list_contacts(phonebook: Phonebook):
-    """UI handler to list all contacts sorted by name."""
+    """UI handler to list all contacts sorted by name, one page at a time."""
     print("\n--- All Contacts ---")
 
-    sorted_contacts = sorted(phonebook.contacts, key=lambda c: c.name)
+    offset = 0
+    while True:
+        # Fetch one extra contact to know whether another page follows.
+        page = list(phonebook.list_contacts(offset=offset, limit=PAGE_SIZE + 1))
 
-    if not sorted_contacts:
-        print("Phonebook is empty.")
-        return
+        if not page and offset == 0:
+            print("Phonebook is empty.")
+            return
+
+        for c in page[:PAGE_SIZE]:
+            print(f" - {c.name} | {c.phone} ({c.country}) | {c.category}")
 
-    for c in sorted_contacts:
-        print(f" - {c.name} | {c.phone} ({c.country}) | {c.category}")
+        if len(page) <= PAGE_SIZE:
+            return
+        if input("Press Enter for more, or 'q' to stop: ").strip().lower() == "q":
+            return
+        offset += PAGE_SIZE
 
 
 def handle_update_contact(phonebook: Phonebook):
@@ -384,13 +1581,15 @@ def handle_update_contact(phonebook: Phonebook):
     """
     print("\n--- Update Contact ---")
     query = input("Enter name to search: ").strip()
-    matches = phonebook.search_contacts(query)
+    target = phonebook.first_match(query)
+    if target is None:
+        # Fall back to names that sound alike when the spelling was a guess.
+        target = next(iter(phonebook.sounds_like(query)), None)
 
-    if not matches:
+    if target is None:
         print("No contact found.")
         return
 
-    target = matches[0]
     print(f"Editing: {target.name} | {target.phone}")
 
     print("1. Name")
@@ -399,15 +1598,14 @@ def handle_update_contact(phonebook: Phonebook):
     choice = input("Select: ")
 
     if choice == "1":
-        target.name = input("Enter new name: ")
+        phonebook.update_contact(target, name=input("Enter new name: "))
     elif choice == "2":
         new_phone = input("Enter new phone: ")
-        target.update_phone(new_phone)
+        phonebook.update_contact(target, phone=new_phone)
         print(f"Country updated to: {target.country}")
     elif choice == "3":
-        target.email = input("Enter new email: ")
+        phonebook.update_contact(target, email=input("Enter new email: "))
 
-    phonebook.save_contacts()
     print("Contact updated!")
 
 
@@ -415,13 +1613,12 @@ def handle_delete_contact(phonebook: Phonebook):
     """UI handler for deleting a contact with a confirmation prompt."""
     print("\n--- Delete Contact ---")
     query = input("Enter name to delete: ").strip()
-    matches = phonebook.search_contacts(query)
+    target = phonebook.first_match(query)
 
-    if not matches:
+    if target is None:
         print("No contact found")
         return
 
-    target = matches[0]
     print(f"Found: {target.name} | {target.phone} | {target.country}")
 
     confirm = input("Are you sure you want to delete this contact? (y/n)?: ").lower()
@@ -433,19 +1630,163 @@ def handle_delete_contact(phonebook: Phonebook):
         print("Deletion Cancelled")
 
 
-def main():
+def build_command_parser() -> argparse.ArgumentParser:
+    """Builds the parser shared by argv subcommands and batch command lines."""
+    parser = argparse.ArgumentParser(
+        prog="app.py",
+        description="PhoneBook. Run without arguments for the interactive menu.",
+        epilog="The password is read from the PHONEBOOK_PASSWORD environment variable.",
+    )
+    parser.add_argument("--contacts", default="contacts.csv", help="contacts file")
+    parser.add_argument("--credentials", default="credentials.csv", help="credentials file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add a contact")
+    add.add_argument("name")
+    add.add_argument("phone")
+    add.add_argument("email")
+    add.add_argument("category", nargs="?", default="General")
+
+    search = commands.add_parser("search", help="search contacts by name")
+    search.add_argument("query")
+
+    update = commands.add_parser("update", help="update the first contact matching a name")
+    update.add_argument("query")
+    update.add_argument("field", choices=["name", "phone", "email"])
+    update.add_argument("value")
+
+    delete = commands.add_parser("delete", help="delete the first contact matching a name")
+    delete.add_argument("query")
+
+    query = commands.add_parser("query", help="run a query, e.g. \"country = Portugal AND name ~ ana LIMIT 5\"")
+    query.add_argument("text")
+    query.add_argument("--explain", action="store_true", help="show the plan instead of running it")
+
+    dedup = commands.add_parser("dedup", help="report contacts that look like duplicates")
+    dedup.add_argument("--merge", action="store_true", help="merge each cluster into its oldest contact")
+
+    listing = commands.add_parser("list", help="list contacts sorted by name")
+    listing.add_argument("prefix", nargs="?", default="")
+
+    batch = commands.add_parser("batch", help="run one command per line from a file or stdin")
+    batch.add_argument("file", nargs="?", default="-", help="command file, '-' for stdin")
+    return parser
+
+
+def run_command(phonebook: Phonebook, args: argparse.Namespace):
+    """Executes one parsed non-interactive command against the phonebook."""
+    if args.command == "add":
+        phonebook.add_contact(Contact(args.name, args.phone, args.email, category=args.category.title()))
+    elif args.command == "search":
+        for contact in phonebook.search_contacts(args.query):
+            print(f"{contact.name} ({contact.phone}) [{contact.category}]")
+    elif args.command == "query" and args.explain:
+        print(phonebook.explain(args.text))
+    elif args.command == "query":
+        for c in phonebook.query(args.text):
+            print(f"{c.name} | {c.phone} ({c.country}) | {c.category}")
+    elif args.command == "dedup":
+        report = phonebook.find_duplicates()
+        for ids in report.clusters:
+            print(" = ".join(f"{c.name} | {c.phone} | {c.email}" for c in map(phonebook.get_contact, ids)))
+        print(f"{len(report.clusters)} cluster(s), {report.compared} pair(s) compared")
+        if args.merge:
+            print(f"Merged away {phonebook.merge_duplicates(report.clusters)} contact(s)")
+    elif args.command == "list":
+        for c in phonebook.list_contacts(prefix=args.prefix):
+            print(f"{c.name} | {c.phone} ({c.country}) | {c.category}")
+    else:
+        target = phonebook.first_match(args.query)
+        if target is None:
+            raise ValueError(f"no contact matches '{args.query}'")
+        if args.command == "update":
+            phonebook.update_contact(target, **{args.field: args.value})
+        else:
+            phonebook.delete_contact(target)
+
+
+def run_batch(phonebook: Phonebook, parser: argparse.ArgumentParser, lines: Iterable[str]) -> int:
+    """
+    Runs one command per line, in the same syntax as the argv subcommands.
+    Blank lines and '#' comments are skipped. Returns the number of commands run.
+    """
+    count = 0
+    for number, line in enumerate(lines, start=1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        try:
+            args = parser.parse_args(words)
+            if args.command == "batch":
+                raise ValueError("batch files cannot be nested")
+            run_command(phonebook, args)
+            count += 1
+        except SystemExit:
+            print(f"line {number}: invalid command", file=sys.stderr)
+        except ValueError as error:
+            print(f"line {number}: {error}", file=sys.stderr)
+    return count
+
+
+def run_cli(argv: List[str]) -> int:
+    """
+    Non-interactive entry point.
+
+    Logs in once, loads the phonebook once, runs the command (or a whole batch
+    file) with persistence deferred, and writes the contacts once at the end.
+    """
+    parser = build_command_parser()
+    args = parser.parse_args(argv)
+
+    auth = Authenticator(args.credentials)
+    if not os.path.exists(auth.filename):
+        print("No account found. Run the interactive menu once to set one up.", file=sys.stderr)
+        return 1
+    if not auth.login(raw_password=os.environ.get("PHONEBOOK_PASSWORD", "")):
+        print("Login failed.", file=sys.stderr)
+        return 1
+
+    phonebook = Phonebook(args.contacts, journal=True)
+    started = time.perf_counter()
+    with phonebook.batch():
+        if args.command != "batch":
+            try:
+                run_command(phonebook, args)
+            except ValueError as error:
+                print(error, file=sys.stderr)
+                return 1
+            return 0
+
+        if args.file == "-":
+            count = run_batch(phonebook, parser, sys.stdin)
+        else:
+            with open(args.file, mode="r", encoding="UTF-8") as file:
+                count = run_batch(phonebook, parser, file)
+
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0.0
+    print(f"{count} command(s) in {elapsed:.3f}s ({rate:.0f} ops/s)", file=sys.stderr)
+    return 0
+
+
+def main(argv: List[str] = None) -> int:
     """
     Application Entry Point.
-    1. Handles Authentication.
-    2. Enters Main Event Loop.
+    1. Runs a non-interactive command if any arguments are given.
+    2. Otherwise handles Authentication.
+    3. Enters Main Event Loop.
     """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return run_cli(argv)
+
     auth = Authenticator("credentials.csv")
 
     if not attempt_login(auth):
         print("Login failed. Exiting.")
-        return
+        return 1
 
-    phonebook = Phonebook("contacts.csv")
+    phonebook = Phonebook("contacts.csv", journal=True)
     print(f"Welcome, {auth.current_user.username}!")
 
     while True:
@@ -470,11 +1811,12 @@ def main():
         elif choice == "5":
             handle_delete_contact(phonebook)
         elif choice == "6":
+            phonebook.compact()
             print("Goodbye!")
-            break
+            return 0
         else:
             print("Invalid option, try again.")
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
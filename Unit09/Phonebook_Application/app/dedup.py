@@ -0,0 +1,138 @@
+"""Duplicate contact detection for the PhoneBook application
+
+Comparing every pair of contacts is quadratic, so contacts are first put
+into blocks that share a cheap key: the last digits of the phone number,
+the email local part or the sound of the name. Only contacts within the
+same block are compared, and matching pairs are joined into clusters with
+a union-find, so the whole pass stays close to linear in the book size.
+"""
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from indexes import levenshtein, search_key
+from phonetic import double_metaphone
+
+# Numbers are compared by their trailing digits, so "+351 912 345 678" and
+# "912345678" agree; shorter numbers are too ambiguous to block on.
+PHONE_MATCH_DIGITS = 9
+MIN_PHONE_DIGITS = 6
+
+# Blocks larger than this (a shared switchboard number, "info@" addresses)
+# say little about identity and would make the pass quadratic again.
+MAX_BLOCK_SIZE = 100
+
+# (name search key, name sound, phone tail, email)
+Profile = Tuple[str, str, str, str]
+
+
+@dataclass
+class DuplicateReport:
+    """Clusters found by find_duplicates and the work it took to find them."""
+    clusters: List[Tuple[int, ...]] = field(default_factory=list)
+    compared: int = 0
+    skipped_blocks: int = 0
+
+
+@lru_cache(maxsize=1 << 16)
+def _word_sound(word: str) -> str:
+    # Books reuse a small vocabulary of given names and surnames, so most
+    # words are encoded once rather than once per contact.
+    return double_metaphone(word)[0]
+
+
+def name_sound(name: str) -> str:
+    """
+    Returns the primary Double Metaphone codes of a name's words, sorted,
+    so "Jon Smith" and "smith, John" sound the same.
+    """
+    return " ".join(sorted(filter(None, map(_word_sound, name.split()))))
+
+
+def email_local_part(email: str) -> str:
+    """Returns the part of an email before '@', without a "+tag", casefolded."""
+    return email.strip().casefold().partition("@")[0].partition("+")[0]
+
+
+def profile(row: Dict[str, str], normalize_phone: Callable[[str], str]) -> Profile:
+    """Returns the normalised fields a row is blocked and compared on."""
+    name = search_key(row["name"])
+    digits = normalize_phone(row["phone"])
+    phone = digits[-PHONE_MATCH_DIGITS:] if len(digits) >= MIN_PHONE_DIGITS else ""
+    return name, name_sound(name), phone, row.get("email", "").strip().casefold()
+
+
+def names_agree(first: str, second: str) -> bool:
+    """True for name search keys that differ by at most one edit in five characters."""
+    return first == second or levenshtein(first, second) <= max(len(first), len(second)) // 5
+
+
+def is_duplicate(first: Profile, second: Profile) -> bool:
+    """Two contacts are the same person if at least two of name, phone and email agree."""
+    name_a, sound_a, phone_a, email_a = first
+    name_b, sound_b, phone_b, email_b = second
+    agreeing = (
+        (bool(sound_a) and sound_a == sound_b) or names_agree(name_a, name_b),
+        bool(phone_a) and phone_a == phone_b,
+        bool(email_a) and email_a == email_b,
+    )
+    return sum(agreeing) >= 2
+
+
+def find_duplicates(rows: Iterable[Dict[str, str]], normalize_phone: Callable[[str], str],
+                    max_block_size: int = MAX_BLOCK_SIZE) -> DuplicateReport:
+    """
+    Groups rows that describe the same contact.
+
+    Each cluster is a tuple of ids in ascending order, and clusters are
+    ordered by their first id. A pair is only compared if the two rows
+    share a block and are not already in the same cluster.
+    """
+    ids: List[int] = []
+    profiles: List[Profile] = []
+    # One table per kind of key, so a phone tail can never meet an email.
+    blocks: Tuple[Dict[str, List[int]], ...] = (defaultdict(list), defaultdict(list), defaultdict(list))
+    for slot, row in enumerate(rows):
+        fields = profile(row, normalize_phone)
+        ids.append(row["id"])
+        profiles.append(fields)
+        _, sound, phone, email = fields
+        for table, key in zip(blocks, (sound, phone, email_local_part(email))):
+            if key:
+                table[key].append(slot)
+
+    parent = list(range(len(ids)))
+
+    def find(slot: int) -> int:
+        while parent[slot] != slot:
+            parent[slot] = parent[parent[slot]]
+            slot = parent[slot]
+        return slot
+
+    report = DuplicateReport()
+    for table in blocks:
+        for members in table.values():
+            if len(members) < 2:
+                continue
+            if len(members) > max_block_size:
+                report.skipped_blocks += 1
+                continue
+            for position, first in enumerate(members):
+                for second in members[position + 1:]:
+                    root_a, root_b = find(first), find(second)
+                    if root_a == root_b:
+                        continue
+                    report.compared += 1
+                    if is_duplicate(profiles[first], profiles[second]):
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    roots = [find(slot) for slot in range(len(ids))]
+    sizes = Counter(roots)
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for slot, root in enumerate(roots):
+        if sizes[root] > 1:
+            clusters[root].append(ids[slot])
+    report.clusters = sorted(tuple(sorted(members)) for members in clusters.values())
+    return report
@@ -0,0 +1,633 @@
+"""In-memory search indexes used by the PhoneBook application"""
+
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate
+from collections import OrderedDict, defaultdict
+from heapq import merge
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+def search_key(text: str) -> str:
+    """
+    Normalises text for matching: casefolded, accents stripped and runs of
+    whitespace collapsed to one space, so "Müller" and "MULLER" compare
+    equal. Returns 'text' itself when it is already normalised, so the key
+    costs no extra memory.
+    """
+    if text.isascii():
+        key = " ".join(text.lower().split())
+    else:
+        decomposed = unicodedata.normalize("NFKD", text.casefold())
+        key = " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).split())
+    return text if key == text else key
+
+
+def normalize_phone(phone: str) -> str:
+    """
+    Reduces a phone number to its E.164 digits: "+44 7700 900-123" and
+    "0044 (7700) 900123" both become "447700900123". Numbers without an
+    international prefix keep their digits as written.
+    """
+    digits = phone[1:] if phone.startswith("+") else phone
+    if not digits.isdigit():
+        digits = "".join(char for char in phone if char.isdigit())
+    if phone.lstrip().startswith("00"):
+        digits = digits[2:]
+    return digits
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns every 3-character substring of the text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from 3-character substrings to the documents containing them.
+
+    A substring query of 3+ characters can only match documents that contain
+    all of its trigrams, so the posting sets are intersected (smallest first)
+    and the few surviving candidates are verified with a real substring test.
+    Documents are identified by any hashable key and returned in the order
+    they were first added.
+    """
+    def __init__(self):
+        self._postings: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._texts: Dict[Hashable, str] = {}
+        self._order: Dict[Hashable, int] = {}
+        self._next_order = 0
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, key: Hashable, text: str):
+        """Indexes a document, replacing its previous text if it already exists."""
+        if key in self._texts:
+            self._unlink(key)
+        else:
+            self._order[key] = self._next_order
+            self._next_order += 1
+
+        self._texts[key] = text
+        for gram in trigrams(text):
+            self._postings[gram].add(key)
+
+    def remove(self, key: Hashable):
+        """Removes a document from the index. Unknown keys are ignored."""
+        if key not in self._texts:
+            return
+        self._unlink(key)
+        del self._texts[key]
+        del self._order[key]
+
+    def search(self, query: str) -> Optional[List[Hashable]]:
+        """
+        Returns the keys whose text contains 'query', in insertion order.
+
+        Returns None for queries shorter than a trigram, which the index
+        cannot narrow down; callers should fall back to a scan.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return None
+
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+
+        hits = [key for key in candidates if query in self._texts[key]]
+        hits.sort(key=self._order.__getitem__)
+        return hits
+
+    def estimate(self, query: str) -> Optional[int]:
+        """
+        Returns an upper bound on the number of hits for 'query' (the size
+        of its rarest trigram's posting), or None if the index cannot help.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return None
+        return min(len(self._postings.get(gram, ())) for gram in grams)
+
+    def _unlink(self, key: Hashable):
+        for gram in trigrams(self._texts[key]):
+            posting = self._postings[gram]
+            posting.discard(key)
+            if not posting:
+                del self._postings[gram]
+
+
+class TermIndex:
+    """
+    Hash map from terms to the documents tagged with them.
+
+    Each document's terms are remembered so it can be retagged or removed
+    without recomputing them. Results come back in the order documents were
+    first added.
+    """
+    def __init__(self):
+        self._postings: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._terms: Dict[Hashable, Set[str]] = {}
+        self._order: Dict[Hashable, int] = {}
+        self._next_order = 0
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, key: Hashable, terms: Iterable[str]):
+        """Tags a document with 'terms', replacing its previous terms if it already exists."""
+        if key in self._terms:
+            self._unlink(key)
+        else:
+            self._order[key] = self._next_order
+            self._next_order += 1
+
+        self._terms[key] = set(terms)
+        for term in self._terms[key]:
+            self._postings[term].add(key)
+
+    def remove(self, key: Hashable):
+        """Removes a document from the index. Unknown keys are ignored."""
+        if key not in self._terms:
+            return
+        self._unlink(key)
+        del self._terms[key]
+        del self._order[key]
+
+    def search(self, groups: Iterable[Iterable[str]]) -> List[Hashable]:
+        """Returns the keys tagged with at least one term from every group."""
+        hits: Optional[Set[Hashable]] = None
+        for group in groups:
+            matches = set().union(*(self._postings.get(term, ()) for term in group))
+            hits = matches if hits is None else hits & matches
+            if not hits:
+                return []
+        return sorted(hits or (), key=self._order.__getitem__)
+
+    def _unlink(self, key: Hashable):
+        for term in self._terms[key]:
+            posting = self._postings[term]
+            posting.discard(key)
+            if not posting:
+                del self._postings[term]
+
+
+class FacetIndex:
+    """
+    Secondary indexes from field values to the set of documents holding them.
+
+    Filtering on several fields intersects their ID sets, smallest first, and
+    the size of each set is a live facet count, so neither needs a scan.
+    Keys must be orderable; results come back sorted by key.
+    """
+    def __init__(self, fields: Iterable[str]):
+        self._postings: Dict[str, Dict[str, Set[Hashable]]] = {field: defaultdict(set) for field in fields}
+        self._values: Dict[Hashable, Dict[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, key: Hashable, values: Dict[str, str]):
+        """Indexes a document's values for every field, replacing previous ones."""
+        if key in self._values:
+            self._unlink(key)
+
+        self._values[key] = {field: values[field] for field in self._postings}
+        for field, value in self._values[key].items():
+            self._postings[field][value].add(key)
+
+    def remove(self, key: Hashable):
+        """Removes a document from the index. Unknown keys are ignored."""
+        if key not in self._values:
+            return
+        self._unlink(key)
+        del self._values[key]
+
+    def filter(self, criteria: Dict[str, str]) -> List[Hashable]:
+        """Returns the keys whose values equal every field in 'criteria'."""
+        if not criteria:
+            return sorted(self._values)
+
+        postings = sorted((self._postings[field].get(value, set()) for field, value in criteria.items()), key=len)
+        hits = set(postings[0])
+        for posting in postings[1:]:
+            hits &= posting
+        return sorted(hits)
+
+    def counts(self, field: str) -> Dict[str, int]:
+        """Returns how many documents hold each value of 'field', most common first."""
+        counts = {value: len(keys) for value, keys in self._postings[field].items()}
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+
+    def _unlink(self, key: Hashable):
+        for field, value in self._values[key].items():
+            posting = self._postings[field][value]
+            posting.discard(key)
+            if not posting:
+                del self._postings[field][value]
+
+
+class _TrieNode:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.keys: Dict[Hashable, str] = {}
+
+
+class PrefixTrie:
+    """
+    Character trie from texts to document keys, for "starts with" lookups.
+
+    A lookup walks one node per character of the prefix and then collects
+    the subtree below it, in text order; documents with the same text are
+    returned in the order they were added. With a 'depth', texts are only
+    spelled out that many characters deep and longer ones share a bucket at
+    the last level, which keeps the node count small for long, mostly unique
+    texts such as phone numbers; prefixes longer than 'depth' are then
+    checked against the bucketed texts.
+    """
+    def __init__(self, depth: int = None):
+        self.depth = depth
+        self._root = _TrieNode()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: Hashable, text: str):
+        """Indexes a document under 'text'."""
+        node = self._root
+        for char in text[:self.depth]:
+            node = node.children.setdefault(char, _TrieNode())
+        if key not in node.keys:
+            self._size += 1
+        node.keys[key] = text
+
+    def remove(self, key: Hashable, text: str):
+        """Removes a document indexed under 'text', pruning empty branches. Unknown keys are ignored."""
+        path = [self._root]
+        for char in text[:self.depth]:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].keys.get(key) != text:
+            return
+
+        del path[-1].keys[key]
+        self._size -= 1
+        for depth in range(len(path) - 1, 0, -1):
+            if path[depth].keys or path[depth].children:
+                break
+            del path[depth - 1].children[text[depth - 1]]
+
+    def iter_keys(self, prefix: str = "") -> Iterator[Hashable]:
+        """Yields the keys of every document whose text starts with 'prefix'."""
+        node = self._root
+        for char in prefix[:self.depth]:
+            node = node.children.get(char)
+            if node is None:
+                return
+
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            entries = sorted(node.keys.items(), key=lambda entry: entry[1])
+            yield from (key for key, text in entries if text.startswith(prefix))
+            pending.extend(node.children[char] for char in sorted(node.children, reverse=True))
+
+
+class SortedIndex:
+    """
+    Keys kept in (text, key) order and updated incrementally.
+
+    Listing in text order is a bisect to the starting point followed by a
+    walk, so there is no re-sort on every listing. Ties on text are ordered
+    by key.
+    """
+    def __init__(self):
+        self._entries: List[Tuple[str, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: Hashable, text: str):
+        """Inserts a key at its sorted position."""
+        insort(self._entries, (text, key))
+
+    def add_many(self, pairs: Iterable[Tuple[Hashable, str]]):
+        """
+        Inserts many (key, text) pairs at once.
+
+        The new entries are appended and the list re-sorted; Timsort merges
+        the existing sorted run with the new one in close to linear time,
+        which beats one insort per key for bulk loads.
+        """
+        new_entries = [(text, key) for key, text in pairs]
+        if len(new_entries) == 1:
+            insort(self._entries, new_entries[0])
+        elif new_entries:
+            self._entries.extend(new_entries)
+            self._entries.sort()
+
+    def remove(self, key: Hashable, text: str):
+        """Removes a key that was indexed under 'text'. Unknown keys are ignored."""
+        index = bisect_left(self._entries, (text, key))
+        if index < len(self._entries) and self._entries[index] == (text, key):
+            del self._entries[index]
+
+    def iter_keys(self, offset: int = 0, prefix: str = "") -> Iterator[Hashable]:
+        """
+        Yields keys in text order, starting 'offset' entries past the first
+        text that begins with 'prefix' and stopping after the last one.
+        """
+        index = bisect_left(self._entries, (prefix,)) + offset
+        while index < len(self._entries):
+            text, key = self._entries[index]
+            if not text.startswith(prefix):
+                return
+            yield key
+            index += 1
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Returns the edit distance (insertions, deletions, substitutions) between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class _BKNode:
+    __slots__ = ("text", "keys", "children")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.keys: Set[Hashable] = set()
+        self.children: Dict[int, "_BKNode"] = {}
+
+
+class PackedTextIndex:
+    """
+    Every document's text packed into one byte buffer for brute-force
+    substring search without any per-query Python loop over documents.
+
+    Texts are UTF-8 encoded and each one is followed by a newline (texts
+    must not contain one), with the start offset and key of every record in
+    parallel arrays. A selective query is a sweep of bytearray.find over the
+    buffer, which runs in C; each hit is mapped back to its record by
+    bisecting the offsets and the sweep resumes at the next record. When a
+    query occurs in a large share of the records, splitting the buffer once
+    and testing every record is cheaper than one find per hit, so that is
+    done instead. Removed texts are blanked out with NUL bytes in place, and
+    the buffer is repacked once more than half of its records are dead.
+
+    Keys come back in the order they were first added. A replaced text is
+    appended to the buffer but keeps its key's place: such moved keys are
+    merged back into the sweep by rank, and a repack restores rank order.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._starts = array("q")
+        self._keys: List[Optional[Hashable]] = []
+        self._slots: Dict[Hashable, int] = {}
+        self._order: Dict[Hashable, int] = {}
+        self._next_order = 0
+        self._moved: Set[Hashable] = set()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, key: Hashable, text: str):
+        """Indexes a document, replacing its previous text if it already exists."""
+        self.add_many(((key, text),))
+
+    def add_many(self, pairs: Iterable[Tuple[Hashable, str]]):
+        """Appends many (key, text) pairs with a single buffer extension."""
+        keys, texts = [], []
+        for key, text in pairs:
+            if key in self._slots:
+                self._blank(self._slots.pop(key))
+                self._moved.add(key)
+            elif key not in self._order:
+                self._order[key] = self._next_order
+                self._next_order += 1
+            keys.append(key)
+            texts.append(text.encode("UTF-8"))
+        if not keys:
+            return
+
+        base = len(self._buffer)
+        self._starts.extend(accumulate((len(text) + 1 for text in texts[:-1]), initial=base))
+        self._buffer += b"\n".join(texts) + b"\n"
+        self._slots.update(zip(keys, range(len(self._keys), len(self._keys) + len(keys))))
+        self._keys.extend(keys)
+        self._repack_if_sparse()
+
+    def remove(self, key: Hashable):
+        """Removes a document from the index. Unknown keys are ignored."""
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        self._blank(slot)
+        del self._order[key]
+        self._moved.discard(key)
+        self._repack_if_sparse()
+
+    def search(self, query: str) -> List[Hashable]:
+        """Returns the keys whose text contains 'query', in the order they were first added."""
+        pattern = query.encode("UTF-8")
+        if not query:
+            hits = [key for key in self._keys if key is not None]
+        elif self._buffer.count(pattern) > len(self._keys) // 16:
+            records = self._buffer.decode("UTF-8").split("\n")
+            hits = [key for key, record in zip(self._keys, records) if key is not None and query in record]
+        else:
+            return list(self.iter_search(query))
+
+        if self._moved:
+            hits.sort(key=self._order.__getitem__)
+        return hits
+
+    def iter_search(self, query: str) -> Iterator[Hashable]:
+        """
+        Yields the keys whose text contains 'query', in the order they were
+        first added, finding each one only when it is asked for.
+        """
+        if not self._moved:
+            yield from self._sweep(query)
+            return
+
+        rank = self._order.__getitem__
+        moved = sorted((key for key in self._moved if query in self._text(self._slots[key])), key=rank)
+        in_place = (key for key in self._sweep(query) if key not in self._moved)
+        yield from merge(in_place, moved, key=rank)
+
+    def _sweep(self, query: str) -> Iterator[Hashable]:
+        """Yields the keys whose text contains 'query', in buffer order."""
+        if not query:
+            yield from (key for key in self._keys if key is not None)
+            return
+
+        pattern = query.encode("UTF-8")
+        find, starts, keys = self._buffer.find, self._starts, self._keys
+        position = find(pattern)
+        while position != -1:
+            slot = bisect_right(starts, position) - 1
+            yield keys[slot]
+            position = find(pattern, self._end(slot) + 1)
+
+    def _text(self, slot: int) -> str:
+        """Returns the text of a live record."""
+        return self._buffer[self._starts[slot]:self._end(slot)].decode("UTF-8")
+
+    def _end(self, slot: int) -> int:
+        """Returns the offset of the newline that ends a record."""
+        following = slot + 1
+        return (self._starts[following] if following < len(self._starts) else len(self._buffer)) - 1
+
+    def _blank(self, slot: int):
+        """Overwrites a record with NUL bytes and frees its slot."""
+        start, end = self._starts[slot], self._end(slot)
+        self._buffer[start:end] = bytes(end - start)
+        self._keys[slot] = None
+
+    def _repack_if_sparse(self):
+        if len(self._keys) > 64 and len(self._slots) < len(self._keys) // 2:
+            self._repack()
+
+    def _repack(self):
+        """Rebuilds the buffer from the live records only, in rank order."""
+        order, next_order = self._order, self._next_order
+        live = sorted(self._slots.items(), key=lambda item: order[item[0]])
+        live = [(key, self._text(slot)) for key, slot in live]
+        self.__init__()
+        self.add_many(live)
+        self._order, self._next_order = order, next_order
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of texts under edit distance, for fuzzy lookups.
+
+    Every child sits at a fixed distance from its parent, so by the triangle
+    inequality a query only has to descend into children whose distance is
+    within 'max_distance' of its own distance to the parent. Documents with
+    the same text share a node; removing a document just empties its node,
+    which stays in place as a routing point. Ties are returned in the order
+    documents were first added.
+    """
+    def __init__(self):
+        self._root: Optional[_BKNode] = None
+        self._nodes: Dict[str, _BKNode] = {}
+        self._texts: Dict[Hashable, str] = {}
+        self._order: Dict[Hashable, int] = {}
+        self._next_order = 0
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, key: Hashable, text: str):
+        """Indexes a document, replacing its previous text if it already exists."""
+        if key in self._texts:
+            self._nodes[self._texts[key]].keys.discard(key)
+        else:
+            self._order[key] = self._next_order
+            self._next_order += 1
+        self._texts[key] = text
+        self._node(text).keys.add(key)
+
+    def remove(self, key: Hashable):
+        """Removes a document from the index. Unknown keys are ignored."""
+        text = self._texts.pop(key, None)
+        if text is not None:
+            self._nodes[text].keys.discard(key)
+            del self._order[key]
+
+    def search(self, query: str, max_distance: int) -> List[Tuple[int, Hashable]]:
+        """Returns (distance, key) pairs within 'max_distance' of 'query', closest first."""
+        hits = []
+        pending = [self._root] if self._root else []
+        while pending:
+            node = pending.pop()
+            distance = levenshtein(query, node.text)
+            if distance <= max_distance:
+                hits.extend((distance, key) for key in node.keys)
+            for edge, child in node.children.items():
+                if abs(edge - distance) <= max_distance:
+                    pending.append(child)
+        hits.sort(key=lambda hit: (hit[0], self._order[hit[1]]))
+        return hits
+
+    def _node(self, text: str) -> _BKNode:
+        """Returns the node for 'text', inserting it into the tree if needed."""
+        node = self._nodes.get(text)
+        if node is not None:
+            return node
+
+        node = self._nodes[text] = _BKNode(text)
+        if self._root is None:
+            self._root = node
+            return node
+
+        parent = self._root
+        while True:
+            edge = levenshtein(text, parent.text)
+            child = parent.children.get(edge)
+            if child is None:
+                parent.children[edge] = node
+                return node
+            parent = child
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry once it holds
+    'maxsize' entries. 'hits' and 'misses' count lookups so the size can be
+    tuned; a 'maxsize' of 0 disables caching.
+    """
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for 'key' and marks it as recently used."""
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for 'key' without counting the lookup or marking it used."""
+        return self._entries.get(key, default)
+
+    def put(self, key: Hashable, value: Any):
+        """Caches a value, evicting the least recently used entry if full."""
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every entry; the hit and miss counters are kept."""
+        self._entries.clear()
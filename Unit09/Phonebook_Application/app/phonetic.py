@@ -0,0 +1,307 @@
+"""Phonetic name encodings used by the PhoneBook application's "sounds like" search"""
+
+import unicodedata
+from typing import Set, Tuple
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("BFPV", "1"),
+    **dict.fromkeys("CGJKQSXZ", "2"),
+    **dict.fromkeys("DT", "3"),
+    "L": "4",
+    **dict.fromkeys("MN", "5"),
+    "R": "6",
+}
+
+_VOWELS = set("AEIOUY")
+
+
+def _letters(word: str) -> str:
+    """Uppercases a word and strips accents and anything that is not a letter (Ç is kept)."""
+    word = word.upper().replace("Ç", "\0")
+    plain = "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+    return "".join(c for c in plain.replace("\0", "Ç") if c.isalpha() and c.isascii() or c == "Ç")
+
+
+def soundex(word: str) -> str:
+    """
+    Returns the American Soundex code of a word: its first letter followed
+    by three digits, e.g. "Robert" and "Rupert" both give "R163".
+    Returns "" for a word without letters.
+    """
+    letters = _letters(word).replace("Ç", "C")
+    if not letters:
+        return ""
+
+    code = letters[0]
+    previous = _SOUNDEX_CODES.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W do not separate letters with the same code; vowels do.
+        if letter not in "HW":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def double_metaphone(word: str, max_length: int = 4) -> Tuple[str, str]:
+    """
+    Returns the (primary, alternate) Double Metaphone codes of a word.
+
+    This is a condensed version of Lawrence Philips' algorithm that keeps
+    its main English, Germanic, Romance and Slavic spelling rules; the
+    alternate code differs from the primary only where a spelling has two
+    common pronunciations (e.g. "Schmidt" gives ("XMT", "SMT")).
+    """
+    text = _letters(word)
+    if not text:
+        return "", ""
+
+    primary, alternate = [], []
+
+    def add(main: str, other: str = None):
+        primary.append(main)
+        alternate.append(main if other is None else other)
+
+    def at(index: int, *options: str) -> bool:
+        return any(text.startswith(option, index) for option in options if index >= 0)
+
+    def vowel(index: int) -> bool:
+        return 0 <= index < len(text) and text[index] in _VOWELS
+
+    slavo_germanic = any(part in text for part in ("W", "K", "CZ", "WITZ"))
+    last = len(text) - 1
+    i = 0
+
+    if at(0, "GN", "KN", "PN", "WR", "PS"):
+        i = 1
+    if text[0] == "X":
+        add("S")
+        i = 1
+
+    while i <= last and len("".join(primary)) < max_length:
+        char = text[i]
+        step = 1
+
+        if char in _VOWELS:
+            if i == 0:
+                add("A")
+        elif char == "B":
+            add("P")
+            step = 2 if at(i + 1, "B") else 1
+        elif char == "Ç":
+            add("S")
+        elif char == "C":
+            if at(i, "CHAE"):
+                add("K", "X")
+                step = 2
+            elif at(i, "CH"):
+                if i == 0 and (at(i, "CHARAC", "CHARIS", "CHOR", "CHYM", "CHEM") or at(0, "SCH")):
+                    add("K")
+                elif at(0, "SCH") or at(i + 2, "T", "S"):
+                    add("K")
+                elif i == 0:
+                    add("X", "K")
+                else:
+                    add("X")
+                step = 2
+            elif at(i, "CZ") and not at(i - 2, "WICZ"):
+                add("S", "X")
+                step = 2
+            elif at(i, "CIA"):
+                add("X")
+                step = 3
+            elif at(i, "CC") and not (i == 1 and text[0] == "M"):
+                if at(i + 2, "I", "E", "H") and not at(i + 2, "HU"):
+                    add("KS" if at(i - 1, "ACCE", "UCCE", "ACCI") else "X")
+                    step = 3
+                else:
+                    add("K")
+                    step = 2
+            elif at(i, "CK", "CG", "CQ"):
+                add("K")
+                step = 2
+            elif at(i, "CI", "CE", "CY"):
+                add("S", "X" if at(i, "CIO", "CIE", "CIA") else "S")
+                step = 2
+            else:
+                add("K")
+                step = 2 if at(i + 1, "C", "K", "Q") and not at(i + 1, "CE", "CI") else 1
+        elif char == "D":
+            if at(i, "DG") and at(i + 2, "I", "E", "Y"):
+                add("J")
+                step = 3
+            else:
+                add("T")
+                step = 2 if at(i, "DT", "DD") else 1
+        elif char == "F":
+            add("F")
+            step = 2 if at(i + 1, "F") else 1
+        elif char == "G":
+            if at(i + 1, "H"):
+                if i > 0 and not vowel(i - 1):
+                    add("K")
+                elif i == 0:
+                    add("J" if at(i + 2, "I") else "K")
+                elif at(i - 2, "B", "H", "D") or at(i - 3, "B", "H", "D") or at(i - 4, "B", "H"):
+                    pass
+                elif i > 2 and at(i - 1, "U") and at(i - 3, "C", "G", "L", "R", "T"):
+                    add("F")
+                elif i > 0 and not at(i - 1, "I"):
+                    add("K")
+                step = 2
+            elif at(i + 1, "N"):
+                if i == 1 and vowel(0) and not slavo_germanic:
+                    add("KN", "N")
+                elif not at(i + 2, "EY") and not at(i + 1, "Y") and not slavo_germanic:
+                    add("N", "KN")
+                else:
+                    add("KN")
+                step = 2
+            elif at(i + 1, "LI") and not slavo_germanic:
+                add("KL", "L")
+                step = 2
+            elif at(i + 1, "E", "I", "Y") or at(i - 1, "AGGI", "OGGI"):
+                if at(0, "SCH") or at(i + 1, "ET"):
+                    add("K")
+                elif at(i + 1, "IER"):
+                    add("J")
+                else:
+                    add("J", "K")
+                step = 2
+            else:
+                add("K")
+                step = 2 if at(i + 1, "G") else 1
+        elif char == "H":
+            if (i == 0 or vowel(i - 1)) and vowel(i + 1):
+                add("H")
+                step = 2
+        elif char == "J":
+            if at(i, "JOSE") and i == 0:
+                add("H")
+            elif at(i, "JOSE"):
+                add("J", "H")
+            elif i == 0:
+                add("J", "A")
+            elif vowel(i - 1) and not slavo_germanic and at(i + 1, "A", "O"):
+                add("J", "H")
+            elif i == last:
+                add("J", "")
+            else:
+                add("J")
+            step = 2 if at(i + 1, "J") else 1
+        elif char == "K":
+            add("K")
+            step = 2 if at(i + 1, "K") else 1
+        elif char == "L":
+            if at(i, "LL") and (at(i - 1, "ILLO", "ILLA", "ALLE") and i + 2 >= last):
+                add("L", "")
+            else:
+                add("L")
+            step = 2 if at(i + 1, "L") else 1
+        elif char == "M":
+            add("M")
+            step = 2 if at(i + 1, "M") or (at(i - 1, "UMB") and (i + 1 == last or at(i + 2, "ER"))) else 1
+        elif char == "N":
+            add("N")
+            step = 2 if at(i + 1, "N") else 1
+        elif char == "P":
+            if at(i + 1, "H"):
+                add("F")
+                step = 2
+            else:
+                add("P")
+                step = 2 if at(i + 1, "P", "B") else 1
+        elif char == "Q":
+            add("K")
+            step = 2 if at(i + 1, "Q") else 1
+        elif char == "R":
+            if i == last and not slavo_germanic and at(i - 2, "IE") and not at(i - 4, "ME", "MA"):
+                add("", "R")
+            else:
+                add("R")
+            step = 2 if at(i + 1, "R") else 1
+        elif char == "S":
+            if at(i - 1, "ISL", "YSL"):
+                pass
+            elif i == 0 and at(i, "SUGAR"):
+                add("X", "S")
+            elif at(i, "SH"):
+                add("S" if at(i + 1, "HEIM", "HOEK", "HOLM", "HOLZ") else "X")
+                step = 2
+            elif at(i, "SIO", "SIA"):
+                add("S", "S" if slavo_germanic else "X")
+                step = 3
+            elif (i == 0 and at(i + 1, "M", "N", "L", "W")) or at(i + 1, "Z"):
+                add("S", "X")
+                step = 2 if at(i + 1, "Z") else 1
+            elif at(i, "SCH"):
+                if at(i + 3, "OO", "ER", "EN", "UY", "ED", "EM"):
+                    add("SK")
+                else:
+                    add("X", "S")
+                step = 3
+            elif at(i, "SC"):
+                add("S" if at(i + 2, "I", "E", "Y") else "SK")
+                step = 3
+            else:
+                add("" if i == last and at(i - 2, "AI", "OI") else "S", "S")
+                step = 2 if at(i + 1, "S", "Z") else 1
+        elif char == "T":
+            if at(i, "TION", "TIA", "TCH"):
+                add("X")
+                step = 3
+            elif at(i, "TH", "TTH"):
+                add("T" if at(i + 2, "OM", "AM") or at(0, "SCH") else "0", "T")
+                step = 2
+            else:
+                add("T")
+                step = 2 if at(i + 1, "T", "D") else 1
+        elif char == "V":
+            add("F")
+            step = 2 if at(i + 1, "V") else 1
+        elif char == "W":
+            if at(i, "WR"):
+                add("R")
+                step = 2
+            elif i == 0 and (vowel(i + 1) or at(i, "WH")):
+                add("A", "F" if vowel(i + 1) else "A")
+            elif (i == last and vowel(i - 1)) or at(i - 1, "EWSKI", "EWSKY", "OWSKI", "OWSKY"):
+                add("", "F")
+            elif at(i, "WICZ", "WITZ"):
+                add("TS", "FX")
+                step = 4
+        elif char == "X":
+            if not (i == last and at(i - 3, "IAU", "EAU") or at(i - 2, "AU", "OU")):
+                add("KS")
+            step = 2 if at(i + 1, "C", "X") else 1
+        elif char == "Z":
+            if at(i + 1, "H"):
+                add("J")
+                step = 2
+            else:
+                add("S", "TS" if at(i + 1, "ZO", "ZI", "ZA") else "S")
+                step = 2 if at(i + 1, "Z") else 1
+
+        i += step
+
+    return "".join(primary)[:max_length], "".join(alternate)[:max_length]
+
+
+def phonetic_keys(word: str) -> Set[str]:
+    """
+    Returns every phonetic key of a word: its Soundex code and both Double
+    Metaphone codes, each tagged with the encoding so they never collide.
+    """
+    primary, alternate = double_metaphone(word)
+    keys = {"S:" + soundex(word), "M:" + primary, "M:" + alternate}
+    keys.discard("S:")
+    keys.discard("M:")
+    return keys
+
+
+def name_phonetic_keys(name: str) -> Set[str]:
+    """Returns the phonetic keys of every word in a name."""
+    return set().union(*(phonetic_keys(word) for word in name.split()))
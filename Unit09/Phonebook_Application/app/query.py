@@ -0,0 +1,340 @@
+"""Contact query language and its index-aware planner for the PhoneBook application
+
+A query is an optional condition followed by optional ORDER BY and LIMIT
+clauses, for example:
+
+    country = Portugal AND (name CONTAINS "ana" OR phone STARTS WITH +351)
+    ORDER BY name DESC LIMIT 10
+
+Conditions compare one of the fields name, phone, email, country and
+category with '=' , '!=', CONTAINS (or '~') and STARTS WITH (or '^='), and
+are combined with AND, OR, NOT and parentheses. Keywords are
+case-insensitive and values may be quoted. Comparisons use the same
+normalised keys as the rest of the application, so they ignore case and
+accents, and phone numbers are compared by their digits.
+"""
+
+import re
+from dataclasses import dataclass, replace
+from itertools import islice
+from typing import Callable, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from indexes import search_key
+
+QUERY_FIELDS = ("name", "phone", "email", "country", "category")
+
+_OPERATORS = {"=": "=", "~": "contains", "^=": "prefix", "contains": "contains"}
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<symbol>!=|\^=|=|~|\(|\))
+      | (?P<word>[^\s()=!~^"']+)
+    )""", re.VERBOSE)
+
+
+class QuerySyntaxError(ValueError):
+    """Raised for a query that does not follow the query language."""
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """One field comparison; 'op' is "=", "contains" or "prefix"."""
+    field: str
+    op: str
+    value: str
+
+    def __str__(self) -> str:
+        op = {"=": "=", "contains": "CONTAINS", "prefix": "STARTS WITH"}[self.op]
+        return f"{self.field} {op} {self.value!r}"
+
+
+@dataclass(frozen=True)
+class And:
+    parts: Tuple["Condition", ...]
+
+    def __str__(self) -> str:
+        return "(" + " AND ".join(map(str, self.parts)) + ")"
+
+
+@dataclass(frozen=True)
+class Or:
+    parts: Tuple["Condition", ...]
+
+    def __str__(self) -> str:
+        return "(" + " OR ".join(map(str, self.parts)) + ")"
+
+
+@dataclass(frozen=True)
+class Not:
+    part: "Condition"
+
+    def __str__(self) -> str:
+        return f"NOT {self.part}"
+
+
+Condition = Union[Predicate, And, Or, Not]
+
+
+@dataclass(frozen=True)
+class Query:
+    """A parsed query: the condition (None matches everything), sort field and limit."""
+    where: Optional[Condition] = None
+    order_by: Optional[str] = None
+    descending: bool = False
+    limit: Optional[int] = None
+
+
+def parse_query(text: str) -> Query:
+    """Parses a query string, raising QuerySyntaxError if it is malformed."""
+    return _Parser(_tokenize(text)).parse()
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    while text[position:].strip():
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise QuerySyntaxError(f"unexpected character at position {position}: {text[position:].strip()[0]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser: OR binds loosest, then AND, then NOT."""
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def parse(self) -> Query:
+        where = None
+        if self._peek() and not self._at_keyword("order", "limit"):
+            where = self._or()
+
+        order_by, descending, limit = None, False, None
+        if self._accept_keyword("order"):
+            self._expect_keyword("by")
+            order_by = self._field()
+            if self._accept_keyword("desc"):
+                descending = True
+            else:
+                self._accept_keyword("asc")
+        if self._accept_keyword("limit"):
+            kind, value = self._next("a number after LIMIT")
+            if kind != "word" or not value.isdigit():
+                raise QuerySyntaxError(f"LIMIT needs a whole number, not {value!r}")
+            limit = int(value)
+        if self._peek():
+            raise QuerySyntaxError(f"unexpected {self._peek()[1]!r}")
+        return Query(where, order_by, descending, limit)
+
+    def _or(self) -> Condition:
+        parts = [self._and()]
+        while self._accept_keyword("or"):
+            parts.append(self._and())
+        return parts[0] if len(parts) == 1 else Or(tuple(parts))
+
+    def _and(self) -> Condition:
+        parts = [self._not()]
+        while self._accept_keyword("and"):
+            parts.append(self._not())
+        return parts[0] if len(parts) == 1 else And(tuple(parts))
+
+    def _not(self) -> Condition:
+        if self._accept_keyword("not"):
+            return Not(self._not())
+        if self._peek() == ("symbol", "("):
+            self.position += 1
+            condition = self._or()
+            if self._next("')'") != ("symbol", ")"):
+                raise QuerySyntaxError("missing ')'")
+            return condition
+        return self._predicate()
+
+    def _predicate(self) -> Condition:
+        field = self._field()
+        kind, op = self._next(f"an operator after {field!r}")
+        negate = op == "!="
+        if op.lower() == "starts":
+            self._expect_keyword("with")
+            op = "prefix"
+        elif negate:
+            op = "="
+        elif op.lower() in _OPERATORS and (kind == "symbol" or op.lower() == "contains"):
+            op = _OPERATORS[op.lower()]
+        else:
+            raise QuerySyntaxError(f"unknown operator {op!r}")
+
+        kind, value = self._next(f"a value after {field!r}")
+        if kind == "symbol":
+            raise QuerySyntaxError(f"expected a value, not {value!r}")
+        predicate = Predicate(field, op, value)
+        return Not(predicate) if negate else predicate
+
+    def _field(self) -> str:
+        kind, value = self._next("a field name")
+        if kind != "word" or value.lower() not in QUERY_FIELDS:
+            raise QuerySyntaxError(f"unknown field {value!r}; expected one of {', '.join(QUERY_FIELDS)}")
+        return value.lower()
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self, expected: str) -> Tuple[str, str]:
+        token = self._peek()
+        if token is None:
+            raise QuerySyntaxError(f"expected {expected} at the end of the query")
+        self.position += 1
+        return token
+
+    def _at_keyword(self, *keywords: str) -> bool:
+        token = self._peek()
+        return token is not None and token[0] == "word" and token[1].lower() in keywords
+
+    def _accept_keyword(self, keyword: str) -> bool:
+        if self._at_keyword(keyword):
+            self.position += 1
+            return True
+        return False
+
+    def _expect_keyword(self, keyword: str):
+        if not self._accept_keyword(keyword):
+            raise QuerySyntaxError(f"expected {keyword.upper()}")
+
+
+class QueryCatalog:
+    """
+    What the planner needs to know about a book: its records, how fields are
+    normalised, and which indexes can answer a predicate at what cost.
+
+    Records can be any objects with the query fields as attributes and an
+    'id'. An index answer may contain extra ids, since every candidate is
+    checked against the full condition afterwards.
+    """
+    def size(self) -> int:
+        """Returns the number of records, which is the cost of a full scan."""
+        raise NotImplementedError
+
+    def records(self, ids: Optional[Iterable[Hashable]] = None) -> Iterator:
+        """Yields every record in book order, or only those with the given ids in id order."""
+        raise NotImplementedError
+
+    def normalize(self, field: str, value: str) -> str:
+        """Returns the comparison key of a query value for 'field'."""
+        return search_key(value)
+
+    def record_key(self, record, field: str) -> str:
+        """Returns the comparison key of a record's 'field'."""
+        return self.normalize(field, getattr(record, field))
+
+    def estimate(self, predicate: Predicate) -> Optional[Tuple[str, int]]:
+        """Returns (index name, estimated rows) for the best index on 'predicate', or None."""
+        return None
+
+    def lookup(self, predicate: Predicate) -> Iterable[Hashable]:
+        """Returns candidate ids for a predicate that 'estimate' accepted."""
+        raise NotImplementedError
+
+
+@dataclass
+class _Access:
+    """How the candidate records are found: a description, a cost and a fetch."""
+    description: str
+    cost: int
+    fetch: Optional[Callable[[], Set[Hashable]]]
+
+
+class QueryPlan:
+    """A query bound to a catalog with the cheapest way found to answer it."""
+    def __init__(self, query: Query, catalog: QueryCatalog):
+        self.catalog = catalog
+        self.query = replace(query, where=self._normalized(query.where))
+        self.size = catalog.size()
+        self.access = self._access_path(self.query.where) or _Access(f"Scan ({self.size} rows)", self.size, None)
+
+    def execute(self) -> list:
+        """Runs the plan and returns the matching records."""
+        where, catalog = self.query.where, self.catalog
+        records = catalog.records(None if self.access.fetch is None else self.access.fetch())
+        matches = (record for record in records if where is None or self._matches(where, record))
+
+        if self.query.order_by is None:
+            # Book order already holds, so the scan can stop at the limit.
+            return list(islice(matches, self.query.limit))
+
+        field = self.query.order_by
+        ordered = sorted(matches, key=lambda record: catalog.record_key(record, field), reverse=self.query.descending)
+        return ordered[:self.query.limit]
+
+    def explain(self) -> str:
+        """Describes the plan, outermost step first, with its estimated cost."""
+        steps = []
+        if self.query.limit is not None:
+            steps.append(f"Limit {self.query.limit}")
+        if self.query.order_by is not None:
+            steps.append(f"Sort by {self.query.order_by} {'DESC' if self.query.descending else 'ASC'}")
+        if self.query.where is not None:
+            steps.append(f"Filter {self.query.where}")
+        steps.append(self.access.description)
+
+        lines = ["  " * depth + step for depth, step in enumerate(steps)]
+        lines.append(f"Estimated cost: {self.access.cost} of {self.size} rows examined")
+        return "\n".join(lines)
+
+    def _normalized(self, condition: Optional[Condition]) -> Optional[Condition]:
+        """Returns the condition with every value replaced by its comparison key."""
+        if condition is None:
+            return None
+        if isinstance(condition, Predicate):
+            return replace(condition, value=self.catalog.normalize(condition.field, condition.value))
+        if isinstance(condition, Not):
+            return Not(self._normalized(condition.part))
+        return type(condition)(tuple(self._normalized(part) for part in condition.parts))
+
+    def _access_path(self, condition: Optional[Condition]) -> Optional[_Access]:
+        """Finds the cheapest index-backed way to narrow 'condition', if any."""
+        if isinstance(condition, Predicate):
+            estimate = self.catalog.estimate(condition)
+            if estimate is None:
+                return None
+            index, rows = estimate
+            return _Access(
+                f"Index {index} on {condition} (est. {rows} rows)", rows,
+                lambda: set(self.catalog.lookup(condition)),
+            )
+
+        if isinstance(condition, And):
+            # Any one conjunct narrows the candidates; the filter checks the rest.
+            paths = [path for path in map(self._access_path, condition.parts) if path is not None]
+            return min(paths, key=lambda path: path.cost, default=None)
+
+        if isinstance(condition, Or):
+            # A union is only complete if every alternative has an index.
+            paths = [self._access_path(part) for part in condition.parts]
+            if None in paths or sum(path.cost for path in paths) >= self.size:
+                return None
+            return _Access(
+                "Union of " + "; ".join(path.description for path in paths),
+                sum(path.cost for path in paths),
+                lambda: set().union(*(path.fetch() for path in paths)),
+            )
+        return None
+
+    def _matches(self, condition: Condition, record) -> bool:
+        if isinstance(condition, Predicate):
+            key = self.catalog.record_key(record, condition.field)
+            if condition.op == "=":
+                return key == condition.value
+            if condition.op == "contains":
+                return condition.value in key
+            return key.startswith(condition.value)
+        if isinstance(condition, And):
+            return all(self._matches(part, record) for part in condition.parts)
+        if isinstance(condition, Or):
+            return any(self._matches(part, record) for part in condition.parts)
+        return not self._matches(condition.part, record)
@@ -0,0 +1,926 @@
+"""Persistence helpers for the PhoneBook application"""
+
+import csv
+import io
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from heapq import merge
+from itertools import accumulate, islice, takewhile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from indexes import normalize_phone, search_key
+
+Row = Dict[str, str]
+
+CONTACT_FIELDS = ["id", "name", "phone", "country", "email", "category"]
+
+
+class ContactJournal:
+    """
+    Append-only log of contact mutations kept next to the CSV snapshot.
+
+    Each mutation is written as one JSON line, so an edit costs a small append
+    instead of a rewrite of the whole contacts file. The snapshot plus the
+    replayed log always describe the current phonebook.
+    """
+    def __init__(self, snapshot_filename: str):
+        self.filename = snapshot_filename + ".log"
+        self.pending = 0
+
+    def append(self, op: str, row: Row):
+        """Logs one mutation: the operation and the contact row it applies to."""
+        with open(self.filename, mode="a", encoding="UTF-8") as file:
+            file.write(json.dumps({"op": op, "row": row}) + "\n")
+        self.pending += 1
+
+    def replay(self) -> Iterator[Tuple[str, Row]]:
+        """
+        Yields the logged (op, row) pairs in the order they were written.
+
+        A truncated last line (e.g. from a crash mid-write) is cut off so that
+        new records are not appended onto it.
+        """
+        self.pending = 0
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, mode="rb+") as file:
+            valid_end = 0
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_end += len(line)
+                self.pending += 1
+                yield record["op"], record["row"]
+            file.truncate(valid_end)
+
+    def clear(self):
+        """Drops the log once its records have been folded into a snapshot."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.pending = 0
+
+
+class ContactStorage:
+    """
+    Interface every Phonebook persistence backend implements.
+
+    Backends exchange contacts as plain row dicts keyed by CONTACT_FIELDS and
+    identify them by their 'id'. A 'resident' backend is loaded fully into
+    memory by the Phonebook; other backends answer reads and searches
+    themselves.
+    """
+    resident = True
+    trusted = False
+    filename = ""
+
+    def load_rows(self) -> Iterator[Row]:
+        """Yields every stored contact row, in insertion order."""
+        raise NotImplementedError
+
+    def replay(self) -> Iterator[Tuple[str, Row]]:
+        """Yields (op, row) mutations still to be applied on top of 'load_rows'."""
+        return iter(())
+
+    def record(self, op: str, row: Row):
+        """Persists one 'add', 'delete' or 'update' of the contact in 'row'."""
+        raise NotImplementedError
+
+    def record_many(self, op: str, rows: Iterable[Row]):
+        """Persists the same mutation for several rows."""
+        for row in rows:
+            self.record(op, row)
+
+    def snapshot_due(self) -> bool:
+        """Tells a resident Phonebook to write a full snapshot with 'save_rows'."""
+        return False
+
+    def save_rows(self, rows: Iterable[Row]):
+        """Replaces the stored contacts with 'rows'."""
+        raise NotImplementedError
+
+    def search_rows(self, needle: str) -> Iterator[Row]:
+        """Yields rows whose name's search key contains 'needle' (non-resident only)."""
+        raise NotImplementedError
+
+    def list_rows(self, offset: int = 0, limit: int = None, prefix: str = "") -> Iterator[Row]:
+        """Yields rows in name order from the first name starting with 'prefix' (non-resident only)."""
+        raise NotImplementedError
+
+    def get_row(self, contact_id: int) -> Optional[Row]:
+        """Returns the row with the given id, or None (non-resident only)."""
+        raise NotImplementedError
+
+    def filter_rows(self, criteria: Dict[str, str]) -> Iterator[Row]:
+        """Yields rows whose fields equal every value in 'criteria' (non-resident only)."""
+        for row in self.load_rows():
+            if all(row[field] == value for field, value in criteria.items()):
+                yield row
+
+    def count_rows(self, field: str) -> Dict[str, int]:
+        """Returns how many rows hold each value of 'field', most common first (non-resident only)."""
+        counts = Counter(row[field] for row in self.load_rows())
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+
+    def phone_rows(self, digits: str, prefix: bool = False) -> Iterator[Row]:
+        """
+        Yields rows whose normalised phone is 'digits', or with 'prefix' set
+        starts with them, ordered by number and then id (non-resident only).
+        """
+        hits = []
+        for row in self.load_rows():
+            key = normalize_phone(row["phone"])
+            if key == digits or (prefix and key.startswith(digits)):
+                hits.append((key, row))
+        hits.sort(key=lambda hit: hit[0])
+        return (row for _, row in hits)
+
+    def max_id(self) -> int:
+        """Returns the highest stored contact id, or 0 (non-resident only)."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Writes out mutations the backend still holds in memory (non-resident only)."""
+
+    def close(self):
+        """Releases any open handles."""
+
+
+class CsvStorage(ContactStorage):
+    """
+    Stores contacts in a CSV file that is rewritten as a whole.
+
+    With 'journal' enabled, mutations are appended to a ContactJournal and a
+    fresh snapshot is only requested once 'compact_threshold' records exist.
+    """
+    def __init__(self, filename: str, journal: bool = False, compact_threshold: int = 1000):
+        self.filename = filename
+        self.journal = ContactJournal(filename) if journal else None
+        self.compact_threshold = compact_threshold
+
+    def load_rows(self) -> Iterator[Row]:
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, mode="r", encoding="UTF-8") as file:
+            yield from csv.DictReader(file)
+
+    def replay(self) -> Iterator[Tuple[str, Row]]:
+        if self.journal:
+            yield from self.journal.replay()
+
+    def record(self, op: str, row: Row):
+        if self.journal:
+            self.journal.append(op, row)
+
+    def snapshot_due(self) -> bool:
+        return not self.journal or self.journal.pending >= self.compact_threshold
+
+    def save_rows(self, rows: Iterable[Row]):
+        self.install_snapshot(self.write_snapshot(rows))
+
+    def write_snapshot(self, rows: Iterable[Row]) -> str:
+        """Writes 'rows' next to the CSV and returns the temporary file's name."""
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, mode="w", newline="", encoding="UTF-8") as file:
+            writer = csv.DictWriter(file, fieldnames=CONTACT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        return temp_filename
+
+    def install_snapshot(self, temp_filename: str):
+        """
+        Moves a file from 'write_snapshot' over the CSV. Anything that maps
+        the CSV must be closed first, or the replace fails on Windows.
+        """
+        # Replace in one step so a crash never leaves a half-written snapshot.
+        os.replace(temp_filename, self.filename)
+        if self.journal:
+            self.journal.clear()
+
+
+class BinaryStorage(CsvStorage):
+    """
+    Stores contacts in a compact binary snapshot instead of CSV.
+
+    After a header, ids are stored as a packed int64 column; names, phones
+    and emails as length-prefixed string tables (a column of character
+    lengths plus one UTF-8 blob); and countries and categories as a small
+    string table plus a uint16 code column. Loading is a single read, a few
+    bulk array conversions and one decode per table. Journal mode works
+    exactly as for CsvStorage.
+    """
+    trusted = True
+
+    MAGIC = b"PBK1"
+    _STRING_FIELDS = ("name", "phone", "email")
+    _CODED_FIELDS = ("country", "category")
+
+    def load_rows(self) -> Iterator[Row]:
+        if not os.path.exists(self.filename):
+            return iter(())
+        with open(self.filename, mode="rb") as file:
+            data = file.read()
+        if data[:4] != self.MAGIC:
+            raise ValueError(f"{self.filename} is not a phonebook snapshot")
+
+        count, = struct.unpack_from("<Q", data, 4)
+        reader = _SectionReader(data, 12)
+        columns = {"id": reader.array("q", count).tolist()}
+        for field in self._STRING_FIELDS:
+            columns[field] = reader.strings()
+        for field in self._CODED_FIELDS:
+            table = reader.strings()
+            columns[field] = [table[code] for code in reader.array("H", count)]
+
+        return (
+            {"id": i, "name": n, "phone": p, "country": co, "email": e, "category": ca}
+            for i, n, p, co, e, ca in zip(*(columns[field] for field in CONTACT_FIELDS))
+        )
+
+    def save_rows(self, rows: Iterable[Row]):
+        rows = list(rows)
+        sections = [_pack_array("q", (int(row["id"]) for row in rows))]
+        for field in self._STRING_FIELDS:
+            sections.append(_pack_strings([row[field] for row in rows]))
+        for field in self._CODED_FIELDS:
+            codes: Dict[str, int] = {}
+            column = _pack_array("H", (codes.setdefault(row[field], len(codes)) for row in rows))
+            sections.append(_pack_strings(list(codes)))
+            sections.append(column)
+
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, mode="wb") as file:
+            file.write(self.MAGIC + struct.pack("<Q", len(rows)))
+            file.writelines(sections)
+        os.replace(temp_filename, self.filename)
+        if self.journal:
+            self.journal.clear()
+
+
+class _SectionReader:
+    """Walks the sections of a BinaryStorage snapshot."""
+    def __init__(self, data: bytes, offset: int):
+        self.data = memoryview(data)
+        self.offset = offset
+
+    def array(self, typecode: str, count: int) -> array:
+        """Reads a little-endian fixed-width column of 'count' integers."""
+        values = array(typecode)
+        end = self.offset + count * values.itemsize
+        values.frombytes(self.data[self.offset:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        self.offset = end
+        return values
+
+    def strings(self) -> List[str]:
+        """Reads a length-prefixed string table."""
+        count, size = struct.unpack_from("<QQ", self.data, self.offset)
+        self.offset += 16
+        lengths = self.array("I", count)
+        text = str(self.data[self.offset:self.offset + size], "UTF-8")
+        self.offset += size
+        return [text[end - length:end] for end, length in zip(accumulate(lengths), lengths)]
+
+
+def _pack_array(typecode: str, values: Iterable[int]) -> bytes:
+    """Packs integers as a little-endian fixed-width column."""
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _pack_strings(values: List[str]) -> bytes:
+    """Packs strings as a count, a byte size, their character lengths and one UTF-8 blob."""
+    blob = "".join(values).encode("UTF-8")
+    return struct.pack("<QQ", len(values), len(blob)) + _pack_array("I", map(len, values)) + blob
+
+
+class RowOffsetIndex:
+    """
+    Random access to the rows of a contacts CSV without parsing all of it.
+
+    The CSV is memory-mapped and a sidecar file ('<csv>.idx') records every
+    row's id and byte offset. The sidecar is itself memory-mapped, so opening
+    a book costs the same whatever its size; it is rebuilt with one scan
+    whenever the CSV's size or modification time no longer match. The sidecar
+    uses native byte order and is only a machine-local cache.
+
+    Rows without an id get one in file order, the same way Phonebook does.
+    """
+    MAGIC = b"PIX2"
+    _HEADER = struct.Struct("<4sIQqQ")
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        self._csv_file = self._csv_map = None
+        self._index_file = self._index_map = None
+        self._ids = self._offsets = memoryview(b"").cast("q")
+        self._slot_of: Optional[Dict[int, int]] = None
+        self.header: List[str] = CONTACT_FIELDS
+        self.open()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def open(self):
+        """Maps the CSV and a valid sidecar, rebuilding the sidecar if needed."""
+        self.close()
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0:
+            return
+
+        self._csv_file = open(self.filename, mode="rb")
+        self._csv_map = mmap.mmap(self._csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = next(csv.reader([self._csv_map.readline().decode("UTF-8")]))
+
+        stat = os.stat(self.filename)
+        if not self._map_index(stat):
+            self._build_index(stat)
+            self._map_index(stat)
+
+    def close(self):
+        """Releases the memory maps (needed before the CSV is replaced on some platforms)."""
+        self._ids = self._offsets = memoryview(b"").cast("q")
+        for handle in (self._index_map, self._index_file, self._csv_map, self._csv_file):
+            if handle is not None:
+                handle.close()
+        self._csv_file = self._csv_map = None
+        self._index_file = self._index_map = None
+
+    def ids(self) -> Iterator[int]:
+        """Yields row ids in file order."""
+        return iter(self._ids)
+
+    def max_id(self) -> int:
+        """Returns the highest row id, or 0 for an empty book."""
+        if not len(self._ids):
+            return 0
+        return self._ids[-1] if self._slot_of is None else max(self._ids)
+
+    def has(self, contact_id: int) -> bool:
+        """Tells whether the CSV holds a row with this id."""
+        return self._find(contact_id) is not None
+
+    def get(self, contact_id: int) -> Optional[Row]:
+        """Parses and returns only the row with this id, or None."""
+        slot = self._find(contact_id)
+        if slot is None:
+            return None
+        return self._parse(self._offsets[slot], contact_id)
+
+    def rows(self) -> Iterator[Row]:
+        """Yields every row in file order, parsed sequentially."""
+        if self._csv_map is None:
+            return
+        self._csv_map.seek(0)
+        lines = iter(self._csv_map.readline, b"")
+        reader = csv.DictReader(line.decode("UTF-8") for line in lines)
+        for contact_id, row in zip(self._ids, reader):
+            row["id"] = contact_id
+            yield row
+
+    def _parse(self, offset: int, contact_id: int) -> Row:
+        self._csv_map.seek(offset)
+        lines = iter(self._csv_map.readline, b"")
+        record = next(csv.reader(line.decode("UTF-8") for line in lines))
+        row = dict(zip(self.header, record))
+        row["id"] = contact_id
+        return row
+
+    def _find(self, contact_id: int) -> Optional[int]:
+        if self._slot_of is not None:
+            return self._slot_of.get(contact_id)
+        slot = bisect_left(self._ids, contact_id)
+        if slot < len(self._ids) and self._ids[slot] == contact_id:
+            return slot
+        return None
+
+    def _map_index(self, stat) -> bool:
+        if not os.path.exists(self.index_filename):
+            return False
+        index_file = open(self.index_filename, mode="rb")
+        if os.fstat(index_file.fileno()).st_size < self._HEADER.size:
+            index_file.close()
+            return False
+        index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ordered, size, mtime, count = self._HEADER.unpack_from(index_map)
+        if (magic, size, mtime) != (self.MAGIC, stat.st_size, stat.st_mtime_ns):
+            index_map.close()
+            index_file.close()
+            return False
+
+        self._index_file, self._index_map = index_file, index_map
+        columns = memoryview(index_map)[self._HEADER.size:].cast("q")
+        self._ids, self._offsets = columns[:count], columns[count:2 * count]
+        # Ids are normally ascending; otherwise fall back to a dict for lookups.
+        self._slot_of = None if ordered else {cid: slot for slot, cid in enumerate(self._ids)}
+        return True
+
+    def _build_index(self, stat):
+        """Scans the CSV once, recording where each (possibly multi-line) row starts."""
+        line_starts = array("q")
+        csv_map = self._csv_map
+        csv_map.seek(0)
+        csv_map.readline()
+
+        def lines():
+            while True:
+                line_starts.append(csv_map.tell())
+                line = csv_map.readline()
+                if not line:
+                    return
+                yield line.decode("UTF-8")
+
+        id_column = self.header.index("id") if "id" in self.header else None
+        ids, offsets, seen = array("q"), array("q"), set()
+        next_id, lines_used = 1, 0
+        for record in csv.reader(lines()):
+            start, lines_used = line_starts[lines_used], len(line_starts)
+            if not record:
+                # DictReader skips blank lines, so they are not rows either.
+                continue
+            offsets.append(start)
+            contact_id = int(record[id_column] or 0) if id_column is not None else 0
+            if not contact_id or contact_id in seen:
+                contact_id = next_id
+            next_id = max(next_id, contact_id + 1)
+            seen.add(contact_id)
+            ids.append(contact_id)
+
+        ordered = all(a < b for a, b in zip(ids, ids[1:]))
+        temp_filename = self.index_filename + ".tmp"
+        with open(temp_filename, mode="wb") as file:
+            file.write(self._HEADER.pack(self.MAGIC, ordered, stat.st_size, stat.st_mtime_ns, len(ids)))
+            file.write(ids.tobytes())
+            file.write(offsets.tobytes())
+        os.replace(temp_filename, self.index_filename)
+
+
+class SqliteStorage(ContactStorage):
+    """
+    Stores contacts in a SQLite database using only the standard library.
+
+    Every mutation is a single-row statement on the contact's id, the database
+    runs in WAL mode, and name searches run inside SQLite, so the Phonebook
+    never has to hold the whole book in memory. The name's search key and
+    the phone's normalised digits are stored next to them so searches and
+    number lookups match exactly like the in-memory ones.
+    """
+    resident = False
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS contacts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            country TEXT NOT NULL,
+            email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            name_key TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS contacts_name ON contacts (name);
+        CREATE INDEX IF NOT EXISTS contacts_phone ON contacts (phone);
+        CREATE INDEX IF NOT EXISTS contacts_country ON contacts (country);
+        CREATE INDEX IF NOT EXISTS contacts_category ON contacts (category);
+        CREATE TABLE IF NOT EXISTS id_high_water (id INTEGER NOT NULL);
+        CREATE TRIGGER IF NOT EXISTS contacts_high_water AFTER INSERT ON contacts
+        BEGIN
+            UPDATE id_high_water SET id = max(id, NEW.id);
+        END;
+    """
+    _COLUMNS = ", ".join(CONTACT_FIELDS)
+    _UPSERT = (
+        f"INSERT OR REPLACE INTO contacts ({_COLUMNS}, name_key, phone_key) "
+        f"VALUES ({', '.join(':' + field for field in CONTACT_FIELDS)}, :name_key, :phone_key)"
+    )
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self._SCHEMA)
+        self._migrate()
+
+    def load_rows(self) -> Iterator[Row]:
+        yield from self._select("ORDER BY id")
+
+    def record(self, op: str, row: Row):
+        with self.connection:
+            if op == "delete":
+                self.connection.execute("DELETE FROM contacts WHERE id = ?", (row["id"],))
+            elif op in ("add", "update"):
+                self.connection.execute(self._UPSERT, _params(row))
+            else:
+                raise ValueError(f"Unknown mutation '{op}'")
+
+    def record_many(self, op: str, rows: Iterable[Row]):
+        if op not in ("add", "update"):
+            super().record_many(op, rows)
+            return
+        with self.connection:
+            self.connection.executemany(self._UPSERT, (_params(row) for row in rows))
+
+    def save_rows(self, rows: Iterable[Row]):
+        with self.connection:
+            self.connection.execute("DELETE FROM contacts")
+            self.connection.executemany(self._UPSERT, (_params(row) for row in rows))
+
+    def search_rows(self, needle: str) -> Iterator[Row]:
+        yield from self._select("WHERE instr(name_key, ?) > 0 ORDER BY id", (needle,))
+
+    def list_rows(self, offset: int = 0, limit: int = None, prefix: str = "") -> Iterator[Row]:
+        # Names compare as UTF-8 bytes, which orders them the same way as Python strings.
+        rows = self._select(
+            "WHERE name >= ? ORDER BY name, id LIMIT ? OFFSET ?",
+            (prefix, -1 if limit is None else limit, offset),
+        )
+        for row in rows:
+            if not row["name"].startswith(prefix):
+                return
+            yield row
+
+    def get_row(self, contact_id: int) -> Optional[Row]:
+        return next(self._select("WHERE id = ?", (contact_id,)), None)
+
+    def filter_rows(self, criteria: Dict[str, str]) -> Iterator[Row]:
+        # Field names are checked because they are spliced into the SQL.
+        fields = [self._column(field) for field in criteria]
+        where = " AND ".join(f"{field} = ?" for field in fields) or "1"
+        yield from self._select(f"WHERE {where} ORDER BY id", tuple(criteria.values()))
+
+    def count_rows(self, field: str) -> Dict[str, int]:
+        field = self._column(field)
+        cursor = self.connection.execute(
+            f"SELECT {field}, count(*) FROM contacts GROUP BY {field} ORDER BY count(*) DESC, {field}"
+        )
+        return dict(cursor)
+
+    def phone_rows(self, digits: str, prefix: bool = False) -> Iterator[Row]:
+        if not prefix:
+            yield from self._select("WHERE phone_key = ? ORDER BY id", (digits,))
+            return
+        # ':' sorts right after '9', so this range holds every key starting with 'digits'.
+        yield from self._select(
+            "WHERE phone_key >= ? AND phone_key < ? ORDER BY phone_key, id", (digits, digits + ":")
+        )
+
+    def max_id(self) -> int:
+        # The highest id ever stored, so ids of deleted contacts are never reused.
+        return self.connection.execute("SELECT id FROM id_high_water").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def _migrate(self):
+        """Brings databases written by older versions up to the current schema."""
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            with self.connection:
+                names = self.connection.execute("SELECT id, name FROM contacts").fetchall()
+                self.connection.executemany(
+                    "UPDATE contacts SET name_key = ? WHERE id = ?",
+                    ((search_key(name), contact_id) for contact_id, name in names),
+                )
+                self.connection.execute("PRAGMA user_version = 1")
+        if version < 2:
+            # Older databases did not track the high-water mark; start it at the current maximum.
+            with self.connection:
+                self.connection.execute("INSERT INTO id_high_water SELECT coalesce(max(id), 0) FROM contacts")
+                self.connection.execute("PRAGMA user_version = 2")
+        if version < 3:
+            # Added here rather than in _SCHEMA so the index is only created once the column exists.
+            with self.connection:
+                self.connection.execute("ALTER TABLE contacts ADD COLUMN phone_key TEXT NOT NULL DEFAULT ''")
+                phones = self.connection.execute("SELECT id, phone FROM contacts").fetchall()
+                self.connection.executemany(
+                    "UPDATE contacts SET phone_key = ? WHERE id = ?",
+                    ((normalize_phone(phone), contact_id) for contact_id, phone in phones),
+                )
+                self.connection.execute("CREATE INDEX contacts_phone_key ON contacts (phone_key)")
+                self.connection.execute("PRAGMA user_version = 3")
+
+    def _column(self, field: str) -> str:
+        if field not in CONTACT_FIELDS:
+            raise ValueError(f"Unknown contact field '{field}'")
+        return field
+
+    def _select(self, clause: str, params=()) -> Iterator[Row]:
+        cursor = self.connection.execute(f"SELECT {self._COLUMNS} FROM contacts {clause}", params)
+        for values in cursor:
+            yield dict(zip(CONTACT_FIELDS, values))
+
+
+SHARD_SCHEMES = ("hash", "initial")
+
+
+class ShardedStorage(ContactStorage):
+    """
+    Splits the contacts across several CSV shard files in one directory.
+
+    The "hash" scheme spreads contacts over 'shard_count' shards by id; the
+    "initial" scheme keeps one shard per first letter of the (casefolded)
+    name, plus one for everything else, so listings by name prefix only
+    read the shard that can contain them.
+
+    Shards are read the first time they are touched and mutations only mark
+    their shard dirty, so 'flush' rewrites just the shards that changed. A
+    one-byte-per-id map ('shards.map') records where every contact lives, so
+    lookups, updates and deletes go straight to a single shard.
+    """
+    resident = False
+
+    _FREE = 255
+    _INITIALS = "abcdefghijklmnopqrstuvwxyz"
+
+    def __init__(self, directory: str, scheme: str = "hash", shard_count: int = 16):
+        if scheme not in SHARD_SCHEMES:
+            raise ValueError(f"Unknown shard scheme '{scheme}'")
+        if scheme == "initial":
+            shard_count = len(self._INITIALS) + 1
+        if not 0 < shard_count < self._FREE:
+            raise ValueError(f"shard_count must be between 1 and {self._FREE - 1}")
+
+        self.filename = directory
+        self.scheme = scheme
+        self.shard_count = shard_count
+        os.makedirs(directory, exist_ok=True)
+        self._shards: Dict[int, _Shard] = {}
+        self._map_filename = os.path.join(directory, "shards.map")
+        self._map_dirty = False
+        self._locations = self._read_map()
+
+    @property
+    def loaded_shards(self) -> List[int]:
+        """Numbers of the shards currently held in memory."""
+        return sorted(self._shards)
+
+    @property
+    def dirty_shards(self) -> List[int]:
+        """Numbers of the shards with mutations not yet flushed."""
+        return sorted(number for number, shard in self._shards.items() if shard.dirty)
+
+    def load_rows(self) -> Iterator[Row]:
+        for contact_id, number in enumerate(self._locations):
+            if number != self._FREE:
+                yield self._shard(number).rows[contact_id]
+
+    def record(self, op: str, row: Row):
+        if op not in ("add", "update", "delete"):
+            raise ValueError(f"Unknown mutation '{op}'")
+
+        row = {**row, "id": int(row["id"])}
+        old = self._location(row["id"])
+        new = None if op == "delete" else self.shard_of(row)
+        if old is not None and old != new:
+            self._shard(old).discard(row["id"])
+        if new is not None:
+            self._shard(new).put(row)
+        if old != new:
+            self._set_location(row["id"], new)
+
+    def flush(self):
+        saved = False
+        for shard in self._shards.values():
+            if shard.dirty:
+                shard.save()
+                saved = True
+        # The map goes last, and after every shard save even if no contact
+        # moved: a map older than any shard is taken as stale and rebuilt.
+        if self._map_dirty or saved:
+            temp_filename = self._map_filename + ".tmp"
+            with open(temp_filename, mode="wb") as file:
+                file.write(self._locations.tobytes())
+            os.replace(temp_filename, self._map_filename)
+            self._map_dirty = False
+
+    def save_rows(self, rows: Iterable[Row]):
+        self._shards = {number: _Shard(self._shard_filename(number), load=False)
+                        for number in range(self.shard_count)}
+        for shard in self._shards.values():
+            shard.dirty = True
+        self._locations = array("B")
+        self._map_dirty = True
+        self.record_many("add", rows)
+        self.flush()
+
+    def search_rows(self, needle: str) -> Iterator[Row]:
+        hits = [
+            row
+            for number in range(self.shard_count)
+            for row in self._shard(number).rows.values()
+            if needle in search_key(row["name"])
+        ]
+        hits.sort(key=lambda row: row["id"])
+        return iter(hits)
+
+    def list_rows(self, offset: int = 0, limit: int = None, prefix: str = "") -> Iterator[Row]:
+        streams = []
+        for number in self.shards_for_prefix(prefix):
+            shard = self._shard(number)
+            entries = shard.sorted_names()
+            start = bisect_left(entries, (prefix,))
+            matches = takewhile(lambda entry: entry[0].startswith(prefix), islice(entries, start, None))
+            streams.append(map(shard.rows.__getitem__, (contact_id for _, contact_id in matches)))
+
+        ordered = merge(*streams, key=lambda row: (row["name"], row["id"]))
+        stop = None if limit is None else offset + limit
+        yield from islice(ordered, offset, stop)
+
+    def get_row(self, contact_id: int) -> Optional[Row]:
+        number = self._location(contact_id)
+        return None if number is None else self._shard(number).rows.get(contact_id)
+
+    def max_id(self) -> int:
+        # Ids of deleted contacts at the end are kept reserved, so they are never reused.
+        return max(len(self._locations) - 1, 0)
+
+    def close(self):
+        self.flush()
+
+    def shard_of(self, row: Row) -> int:
+        """Returns the number of the shard a row belongs to."""
+        if self.scheme == "hash":
+            return int(row["id"]) % self.shard_count
+        initial = row["name"][:1].casefold()
+        if len(initial) == 1 and initial in self._INITIALS:
+            return self._INITIALS.index(initial)
+        return len(self._INITIALS)
+
+    def shards_for_prefix(self, prefix: str) -> List[int]:
+        """Returns the shards that can hold names starting with 'prefix'."""
+        if self.scheme == "initial" and prefix:
+            return [self.shard_of({"name": prefix})]
+        return list(range(self.shard_count))
+
+    def _shard(self, number: int) -> "_Shard":
+        shard = self._shards.get(number)
+        if shard is None:
+            shard = self._shards[number] = _Shard(self._shard_filename(number))
+        return shard
+
+    def _shard_filename(self, number: int) -> str:
+        return os.path.join(self.filename, f"shard-{number:03d}.csv")
+
+    def _location(self, contact_id: int) -> Optional[int]:
+        if 0 <= contact_id < len(self._locations) and self._locations[contact_id] != self._FREE:
+            return self._locations[contact_id]
+        return None
+
+    def _set_location(self, contact_id: int, number: Optional[int]):
+        missing = contact_id + 1 - len(self._locations)
+        if missing > 0:
+            self._locations.extend([self._FREE] * missing)
+        self._locations[contact_id] = self._FREE if number is None else number
+        self._map_dirty = True
+
+    def _read_map(self) -> array:
+        """Reads the id-to-shard map, rebuilding it from the shards if it is missing or stale."""
+        shard_times = [
+            entry.stat().st_mtime_ns for entry in os.scandir(self.filename)
+            if entry.name.startswith("shard-") and entry.name.endswith(".csv")
+        ]
+        if os.path.exists(self._map_filename):
+            if os.stat(self._map_filename).st_mtime_ns >= max(shard_times, default=0):
+                locations = array("B")
+                with open(self._map_filename, mode="rb") as file:
+                    locations.frombytes(file.read())
+                return locations
+
+        locations = array("B")
+        self._locations = locations
+        for number in range(self._FREE):
+            if os.path.exists(self._shard_filename(number)):
+                for contact_id in self._shard(number).rows:
+                    self._set_location(contact_id, number)
+        return locations
+
+
+class _Shard:
+    """The rows of one shard file, kept by id, and whether they changed since the last save."""
+    def __init__(self, filename: str, load: bool = True):
+        self.storage = CsvStorage(filename)
+        self.rows: Dict[int, Row] = {}
+        self.dirty = False
+        self._names: Optional[List[Tuple[str, int]]] = None
+        if load:
+            for row in self.storage.load_rows():
+                row["id"] = int(row["id"])
+                self.rows[row["id"]] = row
+
+    def put(self, row: Row):
+        self.rows[row["id"]] = row
+        self.dirty = True
+        self._names = None
+
+    def discard(self, contact_id: int):
+        if self.rows.pop(contact_id, None) is not None:
+            self.dirty = True
+            self._names = None
+
+    def sorted_names(self) -> List[Tuple[str, int]]:
+        """(name, id) pairs in order, rebuilt after the shard changes."""
+        if self._names is None:
+            self._names = sorted((row["name"], contact_id) for contact_id, row in self.rows.items())
+        return self._names
+
+    def save(self):
+        self.storage.save_rows(self.rows.values())
+        self.dirty = False
+
+
+def _params(row: Row) -> Row:
+    """Builds named SQL parameters for a row, including its search keys."""
+    return {**row, "name_key": search_key(row["name"]), "phone_key": normalize_phone(row["phone"])}
+
+
+def read_rows(path: str) -> Iterator[Row]:
+    """
+    Streams contact rows from a CSV file, or from a JSON Lines file when the
+    name ends in '.jsonl' or '.ndjson'.
+    """
+    with open(path, mode="r", newline="", encoding="UTF-8") as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def write_rows(path: str, rows: Iterable[Row], file_format: str = "csv") -> int:
+    """
+    Writes rows to 'path' one at a time as "csv" or "jsonl".
+    Returns the number of rows written.
+    """
+    if file_format not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown export format '{file_format}'")
+
+    count = 0
+    with open(path, mode="w", newline="", encoding="UTF-8") as file:
+        if file_format == "csv":
+            writer = csv.DictWriter(file, fieldnames=CONTACT_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row) + "\n")
+                count += 1
+    return count
+
+
+def split_csv_ranges(filename: str, parts: int) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """
+    Splits a CSV file's data rows into about 'parts' byte ranges that each
+    start and end on a row boundary.
+
+    A newline only ends a row when an even number of quote characters
+    precedes it within the current range, so quoted fields containing
+    newlines are never cut in half. Returns the header and the ranges.
+    """
+    with open(filename, mode="rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header = next(csv.reader([data.readline().decode("UTF-8")]))
+        start, size = data.tell(), len(data)
+        step = max(1, (size - start) // max(1, parts))
+
+        bounds = [start]
+        for target in range(start + step, size, step):
+            position = max(target, bounds[-1])
+            odd_quotes = data[bounds[-1]:position].count(b'"') % 2
+            while position < size:
+                newline = data.find(b"\n", position)
+                if newline == -1:
+                    position = size
+                    break
+                odd_quotes ^= data[position:newline].count(b'"') % 2
+                position = newline + 1
+                if not odd_quotes:
+                    break
+            if position >= size:
+                break
+            bounds.append(position)
+
+    return header, list(zip(bounds, bounds[1:] + [size]))
+
+
+def read_csv_range(filename: str, start: int, end: int) -> Iterator[List[str]]:
+    """Parses the CSV records in one byte range from 'split_csv_ranges'."""
+    with open(filename, mode="rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode("UTF-8")
+    return csv.reader(io.StringIO(text, newline=""))
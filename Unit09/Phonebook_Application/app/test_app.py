@@ -0,0 +1,723 @@
+# test_app.py
+
+import gc
+import os
+from dataclasses import replace
+
+import pytest
+
+from app import (
+    Contact, Phonebook, build_command_parser, field_matches, load_csv_parallel, lookup_country, normalize_phone,
+    resolve_countries, run_batch, _parse_csv_chunk,
+)
+from phonetic import double_metaphone, soundex
+from query import QuerySyntaxError
+from storage import BinaryStorage, ShardedStorage, SqliteStorage, split_csv_ranges
+
+
+def make_phonebook(tmp_path, *contacts):
+    phonebook = Phonebook(str(tmp_path / "contacts.csv"))
+    for contact in contacts:
+        phonebook.add_contact(contact)
+    return phonebook
+
+
+def test_lookup_country_prefers_longest_prefix():
+    assert lookup_country("+1876555000") == "Jamaica"
+    assert lookup_country("+1555000") == "USA/Canada"
+    assert lookup_country("+351912345678") == "Portugal"
+    assert lookup_country("0044123") == "Unknown"
+
+
+def test_resolve_countries_matches_single_lookup():
+    phones = ["+441234", "+35191", "+4412", "", "+999"]
+    assert resolve_countries(phones) == [lookup_country(p) for p in phones]
+
+
+def test_load_contacts_resolves_countries(tmp_path):
+    make_phonebook(tmp_path, Contact("Ana", "+351911", "ana@example.com"))
+    reloaded = Phonebook(str(tmp_path / "contacts.csv"))
+    assert reloaded.contacts[0].country == "Portugal"
+
+
+def test_journal_replays_mutations_over_snapshot(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    phonebook = Phonebook(filename, journal=True)
+    ana = Contact("Ana", "+351911", "ana@example.com")
+    phonebook.add_contact(ana)
+    phonebook.add_contact(Contact("Bob", "+4477", "bob@example.com"))
+    phonebook.update_contact(ana, phone="+4412")
+    phonebook.delete_contact(phonebook.search_contacts("bob")[0])
+
+    reloaded = Phonebook(filename, journal=True)
+    assert [(c.name, c.country) for c in reloaded.contacts] == [("Ana", "UK")]
+    assert reloaded.storage.journal.pending == 4
+
+
+def test_journal_compacts_into_snapshot(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    phonebook = Phonebook(filename, journal=True, compact_threshold=2)
+    phonebook.add_contact(Contact("Ana", "+351911", "ana@example.com"))
+    phonebook.add_contact(Contact("Bob", "+4477", "bob@example.com"))
+
+    assert phonebook.storage.journal.pending == 0
+    assert len(Phonebook(filename).contacts) == 2
+
+
+def test_updates_keep_a_contacts_place_in_indexed_results(tmp_path):
+    books = [
+        Phonebook(str(tmp_path / "plain.csv")),
+        Phonebook(str(tmp_path / "trigram.csv"), trigram_index=True),
+        Phonebook(str(tmp_path / "packed.csv"), packed_search=True),
+    ]
+    for phonebook in books:
+        for name in ["Ana One", "Ana Two", "Bob"]:
+            phonebook.add_contact(Contact(name, "+351911", "x@example.com"))
+        phonebook.sounds_like("ana")
+        first = phonebook.first_match("ana")
+        phonebook.update_contact(first, email="one@example.com")
+        phonebook.update_contact(first, name="Anna One")
+
+        assert [c.name for c in phonebook.search_contacts("one")] == ["Anna One"]
+        assert [c.name for c in phonebook.search_contacts("n")] == ["Anna One", "Ana Two"]
+        assert phonebook.first_match("an").name == "Anna One"
+        assert [c.name for c in phonebook.sounds_like("ana")] == ["Anna One", "Ana Two"]
+
+
+def test_trigram_index_matches_linear_search(tmp_path):
+    names = ["Ana Silva", "Anabela", "Joana", "SILVANA", "Bob"]
+    indexed = Phonebook(str(tmp_path / "indexed.csv"), trigram_index=True)
+    plain = Phonebook(str(tmp_path / "plain.csv"))
+    for phonebook in (indexed, plain):
+        for name in names:
+            phonebook.add_contact(Contact(name, "+351911", "x@example.com"))
+        phonebook.update_contact(phonebook.get_contact(5), name="Roberto Silva")
+        phonebook.update_contact(phonebook.get_contact(2), name="Isabela Silva")
+
+    for query in ["ana", "SILV", "a", "", "obert", "bela", "zzz"]:
+        assert indexed.search_contacts(query) == plain.search_contacts(query)
+    assert [c.name for c in indexed.search_contacts("silva")] == [
+        "Ana Silva", "Isabela Silva", "SILVANA", "Roberto Silva",
+    ]
+
+
+def test_sqlite_storage_round_trip(tmp_path):
+    filename = str(tmp_path / "contacts.db")
+    phonebook = Phonebook(filename, storage=SqliteStorage(filename))
+    phonebook.add_contact(Contact("Ana", "+351911", "ana@example.com"))
+    phonebook.add_contact(Contact("Ana", "+351911", "ana@example.com"))
+    phonebook.add_contact(Contact("Bob", "+4477", "bob@example.com"))
+    phonebook.update_contact(phonebook.search_contacts("BO")[0], name="Bobby")
+    phonebook.delete_contact(phonebook.search_contacts("ana")[0])
+    phonebook.storage.close()
+
+    reopened = Phonebook(filename, storage=SqliteStorage(filename))
+    assert [c.name for c in reopened.contacts] == ["Ana", "Bobby"]
+    assert reopened.search_contacts("obb")[0].country == "UK"
+    reopened.delete_contact(reopened.search_contacts("obb")[0])
+    reopened.storage.close()
+
+    # The deleted highest id stays reserved across reopening.
+    reopened = Phonebook(filename, storage=SqliteStorage(filename))
+    reopened.add_contact(Contact("Carla", "+351912", "carla@example.com"))
+    assert [c.id for c in reopened.contacts] == [2, 4]
+    reopened.storage.close()
+
+
+def test_delete_removes_only_the_given_duplicate(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    first = Contact("Ana", "+351911", "ana@example.com")
+    second = Contact("Ana", "+351911", "ana@example.com")
+    phonebook = make_phonebook(tmp_path, first, second)
+    phonebook.delete_contact(second)
+
+    reloaded = Phonebook(filename)
+    assert [c.id for c in reloaded.contacts] == [first.id]
+    assert reloaded.get_contact(first.id) == first
+    assert reloaded.get_contact(second.id) is None
+
+
+def test_updating_a_deleted_contact_does_not_bring_it_back(tmp_path):
+    filename = str(tmp_path / "contacts.db")
+    books = [
+        Phonebook(str(tmp_path / "contacts.csv"), journal=True),
+        Phonebook(filename, storage=SqliteStorage(filename)),
+    ]
+    for phonebook in books:
+        phonebook.add_contact(Contact("Zed", "+351911", "zed@example.com"))
+        stale = phonebook.first_match("zed")
+        phonebook.delete_contact(stale)
+        phonebook.update_contact(stale, email="new@example.com")
+        assert phonebook.contacts == []
+        phonebook.storage.close()
+
+    assert Phonebook(str(tmp_path / "contacts.csv"), journal=True).contacts == []
+    reopened = Phonebook(filename, storage=SqliteStorage(filename))
+    assert reopened.contacts == []
+    reopened.storage.close()
+
+
+def test_adding_a_contact_never_renumbers_another_books_contact(tmp_path):
+    contact = Contact("Ana", "+351911", "ana@example.com")
+    phonebook = make_phonebook(tmp_path, contact, Contact("Bob", "+4477", "bob@example.com"))
+    again = phonebook.add_contact(contact)
+    assert (contact.id, again.id) == (1, 3)
+    assert [c.id for c in phonebook.contacts] == [1, 2, 3]
+    phonebook.delete_contact(contact)
+    assert [(c.id, c.name) for c in Phonebook(str(tmp_path / "contacts.csv")).contacts] == [(2, "Bob"), (3, "Ana")]
+
+    filename = str(tmp_path / "contacts.db")
+    on_disk = Phonebook(filename, storage=SqliteStorage(filename))
+    on_disk.add_contact(Contact("Zed", "+351912", "z@example.com"))
+    on_disk.add_contact(Contact("Yan", "+351913", "y@example.com"))
+    bob = phonebook.first_match("bob")
+    assert on_disk.add_contact(bob).id == 3
+    assert bob.id == 2
+    assert [c.name for c in phonebook.search_contacts("b")] == ["Bob"]
+    phonebook.delete_contact(bob)
+    assert [c.name for c in phonebook.contacts] == ["Ana"]
+    on_disk.storage.close()
+
+
+def test_updates_and_deletes_use_the_stored_record(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    make_phonebook(tmp_path, Contact("Zed", "+351911", "z@example.com"))
+    columnar = Phonebook(str(tmp_path / "columnar.csv"), columnar=True)
+    columnar.add_contact(Contact("Zed", "+351911", "z@example.com"))
+    for phonebook in (columnar, Phonebook(filename, lazy=True)):
+        original = Contact("Ana", "+351912", "ana@example.com")
+        phonebook.add_contact(original)
+        assert [c.name for c in phonebook.list_contacts()] == ["Ana", "Zed"]
+        phonebook.update_contact(phonebook.get_contact(original.id), name="Beatriz")
+
+        # 'original' still says "Ana", which must neither come back nor confuse the indexes.
+        phonebook.update_contact(original, email="b@example.com")
+        stored = phonebook.get_contact(original.id)
+        assert (stored.name, stored.email) == ("Beatriz", "b@example.com")
+        assert [c.name for c in phonebook.list_contacts()] == ["Beatriz", "Zed"]
+
+        phonebook.delete_contact(original)
+        assert [c.name for c in phonebook.list_contacts()] == ["Zed"]
+        assert phonebook.search_contacts("beatriz") == []
+
+
+def test_columnar_store_behaves_like_dict_store(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    phonebook = Phonebook(filename, columnar=True, trigram_index=True)
+    for i in range(100):
+        phonebook.add_contact(Contact(f"Person {i}", "+351911", "p@example.com", category="Family"))
+    for contact in phonebook.contacts[:80]:
+        phonebook.delete_contact(contact)
+    target = phonebook.search_contacts("son 95")[0]
+    phonebook.update_contact(target, name="Renamed", phone="+4412")
+
+    assert len(phonebook.contacts) == 20
+    assert phonebook.get_contact(target.id).country == "UK"
+    assert phonebook.search_contacts("renamed") == [target]
+    assert Phonebook(filename).contacts == phonebook.contacts
+
+
+def test_list_contacts_pages_in_name_order(tmp_path):
+    names = ["Carla", "ana", "Bruno", "Ana", "Bea", "Ana"]
+    phonebook = make_phonebook(tmp_path, *(Contact(n, "+351911", "x@example.com") for n in names))
+    assert phonebook.sorted_names is None
+    phonebook.update_contact(phonebook.search_contacts("carla")[0], name="Abel")
+
+    expected = sorted(phonebook.contacts, key=lambda c: c.name)
+    assert list(phonebook.list_contacts()) == expected
+    assert list(phonebook.list_contacts(offset=2, limit=2)) == expected[2:4]
+    assert [c.name for c in phonebook.list_contacts(prefix="B")] == ["Bea", "Bruno"]
+
+    phonebook.update_contact(phonebook.search_contacts("bea")[0], name="Zoe")
+    phonebook.delete_contact(phonebook.search_contacts("bruno")[0])
+    phonebook.add_contact(Contact("Bia", "+351911", "x@example.com"))
+    assert list(phonebook.list_contacts()) == sorted(phonebook.contacts, key=lambda c: c.name)
+    assert [c.name for c in phonebook.list_contacts(prefix="B")] == ["Bia"]
+
+
+def test_sqlite_list_contacts_matches_resident(tmp_path):
+    filename = str(tmp_path / "contacts.db")
+    phonebook = Phonebook(filename, storage=SqliteStorage(filename))
+    for name in ["Carla", "Ana", "Bruno", "Bea"]:
+        phonebook.add_contact(Contact(name, "+351911", "x@example.com"))
+
+    assert [c.name for c in phonebook.list_contacts(offset=1, limit=2)] == ["Bea", "Bruno"]
+    assert [c.name for c in phonebook.list_contacts(prefix="B")] == ["Bea", "Bruno"]
+    phonebook.storage.close()
+
+
+def test_run_batch_writes_contacts_once(tmp_path, capsys):
+    phonebook = Phonebook(str(tmp_path / "contacts.csv"), journal=True)
+    lines = [
+        'add "Ana Silva" +351911 ana@example.com family',
+        'add Bob +4477 bob@example.com',
+        '# comments and blank lines are skipped',
+        '',
+        'update bob phone +33123',
+        'search silva',
+        'delete nobody',
+    ]
+    with phonebook.batch():
+        count = run_batch(phonebook, build_command_parser(), lines)
+        assert not (tmp_path / "contacts.csv").exists()
+
+    assert count == 4
+    assert "Ana Silva (+351911) [Family]" in capsys.readouterr().out
+    reloaded = Phonebook(str(tmp_path / "contacts.csv"))
+    assert [(c.name, c.country) for c in reloaded.contacts] == [("Ana Silva", "Portugal"), ("Bob", "France")]
+
+
+def test_import_deduplicates_and_exports_round_trip(tmp_path):
+    phonebook = make_phonebook(tmp_path, Contact("Ana", "+351911", "ana@example.com"))
+    rows = [
+        {"name": "ANA ", "phone": "+351911", "email": "Ana@example.com"},
+        {"name": "Bob", "phone": "+4477", "email": "bob@example.com", "category": "Friends"},
+        {"name": "", "phone": "+4477", "email": "nobody@example.com"},
+        Contact("Bob", "+4477", "bob@example.com"),
+        Contact("Carla", "+3312", "carla@example.com"),
+    ]
+    summary = phonebook.import_contacts(rows, batch_size=2)
+    assert (summary.imported, summary.duplicates, summary.rejected) == (2, 2, 1)
+
+    for file_format in ("csv", "jsonl"):
+        path = str(tmp_path / f"export.{file_format}")
+        assert phonebook.export_contacts(path, file_format) == 3
+        copy = Phonebook(str(tmp_path / f"copy_{file_format}.csv"))
+        copy.import_contacts(path)
+        assert [(c.name, c.country, c.category) for c in copy.list_contacts()] == [
+            ("Ana", "Portugal", "General"), ("Bob", "UK", "Friends"), ("Carla", "France", "General"),
+        ]
+
+
+def test_import_accepts_null_optional_fields(tmp_path):
+    path = tmp_path / "nulls.jsonl"
+    path.write_text(
+        '{"name": "Ana", "phone": "+351911", "email": null, "country": null, "category": null}\n'
+        '{"name": "Ana", "phone": "+351911", "email": ""}\n',
+        encoding="UTF-8",
+    )
+    phonebook = make_phonebook(tmp_path)
+    summary = phonebook.import_contacts(str(path))
+    assert (summary.imported, summary.duplicates) == (1, 1)
+    assert [(c.email, c.country, c.category) for c in phonebook.contacts] == [("", "Portugal", "General")]
+
+
+def test_binary_snapshot_round_trip(tmp_path):
+    filename = str(tmp_path / "contacts.pbk")
+    phonebook = Phonebook(filename, storage=BinaryStorage(filename, journal=True))
+    phonebook.import_contacts([
+        {"name": "Zoë Müller", "phone": "+49301", "email": "zoe@example.com", "category": "Family"},
+        {"name": "Ana", "phone": "+351911", "email": "ana@example.com"},
+    ])
+    phonebook.add_contact(Contact("Bob", "+4477", "", category="Emergency"))
+
+    reloaded = Phonebook(filename, storage=BinaryStorage(filename, journal=True))
+    assert reloaded.contacts == phonebook.contacts
+    reloaded.compact()
+    assert Phonebook(filename, storage=BinaryStorage(filename)).contacts == phonebook.contacts
+
+
+def test_lazy_mode_decodes_rows_on_demand(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    make_phonebook(
+        tmp_path,
+        Contact("Ana", "+351911", "ana@example.com"),
+        Contact("Multi\nLine", "+4477", "ml@example.com"),
+        Contact("Bob", "+3312", "bob@example.com"),
+    )
+    eager = Phonebook(filename)
+
+    lazy = Phonebook(filename, journal=True, lazy=True)
+    assert lazy.contacts == eager.contacts
+    assert lazy.search_contacts("line") == eager.search_contacts("line")
+    lazy.add_contact(Contact("Carla", "+4412", "carla@example.com"))
+    lazy.update_contact(lazy.search_contacts("bob")[0], name="Aaron")
+    lazy.delete_contact(lazy.get_contact(1))
+    assert [c.name for c in lazy.list_contacts()] == ["Aaron", "Carla", "Multi\nLine"]
+
+    replayed = Phonebook(filename, journal=True, lazy=True)
+    assert replayed.contacts == lazy.contacts
+    replayed.compact()
+    assert Phonebook(filename, lazy=True).contacts == lazy.contacts == Phonebook(filename).contacts
+
+
+def test_lazy_mode_skips_blank_lines(tmp_path):
+    path = tmp_path / "contacts.csv"
+    path.write_text(
+        "id,name,phone,country,email,category\n"
+        "1,Ana,+351911,Portugal,ana@example.com,General\n"
+        "\n"
+        "2,Bob,+4477,UK,bob@example.com,Friends\n",
+        encoding="UTF-8",
+    )
+    lazy = Phonebook(str(path), lazy=True)
+    assert lazy.contacts == Phonebook(str(path)).contacts
+    assert lazy.get_contact(2).name == "Bob"
+
+
+def test_lazy_save_unmaps_the_csv_before_replacing_it(tmp_path, monkeypatch):
+    filename = str(tmp_path / "contacts.csv")
+    make_phonebook(tmp_path, Contact("Ana", "+351911", "ana@example.com"))
+    lazy = Phonebook(filename, lazy=True)
+    rows = lazy._contacts._rows
+    mapped_at_replace = []
+    real_replace = os.replace
+
+    def checked_replace(source, target):
+        if target == filename:
+            mapped_at_replace.append(rows._csv_map is not None)
+        real_replace(source, target)
+
+    monkeypatch.setattr(os, "replace", checked_replace)
+    lazy.add_contact(Contact("Bob", "+4477", "bob@example.com"))
+    assert mapped_at_replace == [False]
+    assert [c.name for c in lazy.list_contacts()] == ["Ana", "Bob"]
+    assert Phonebook(filename).contacts == lazy.contacts
+
+
+def test_parallel_load_matches_serial_load(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    make_phonebook(tmp_path, *(
+        Contact(f'Person "{i}"\nSecond line', "+351911" if i % 2 else "+4477", f"p{i}@example.com")
+        for i in range(200)
+    ))
+
+    assert load_csv_parallel(filename, workers=2, chunk_bytes=512) == Phonebook(filename).contacts
+
+
+def test_parallel_load_uses_every_worker_and_skips_blank_lines(tmp_path, monkeypatch):
+    path = tmp_path / "contacts.csv"
+    path.write_text(
+        "id,name,phone,country,email,category\n"
+        + "".join(f"{i},Person {i},+351911,Portugal,p{i}@example.com,General\n\n" for i in range(1, 40)),
+        encoding="UTF-8",
+    )
+    requested = []
+    monkeypatch.setattr("app.split_csv_ranges", lambda *args: requested.append(args[1]) or split_csv_ranges(*args))
+
+    assert load_csv_parallel(str(path), workers=3) == Phonebook(str(path)).contacts
+    assert requested == [3]
+
+
+def test_parallel_parse_worker_leaves_the_collector_enabled(tmp_path):
+    filename = str(tmp_path / "contacts.csv")
+    make_phonebook(tmp_path, Contact("Ana", "+351911", "ana@example.com"))
+    header, [(start, end)] = split_csv_ranges(filename, 1)
+
+    assert gc.isenabled()
+    assert [values[1] for values in _parse_csv_chunk(filename, start, end, header)] == ["Ana"]
+    assert gc.isenabled()
+
+
+def test_sharded_storage_loads_and_flushes_only_touched_shards(tmp_path):
+    directory = str(tmp_path / "shards")
+    phonebook = Phonebook(directory, storage=ShardedStorage(directory, scheme="initial"))
+    with phonebook.batch():
+        for name in ["Ana", "bea", "Bruno", "Carla", "Zoë", "Éva"]:
+            phonebook.add_contact(Contact(name, "+351911", "x@example.com"))
+    reference = make_phonebook(tmp_path, *phonebook.contacts)
+
+    storage = ShardedStorage(directory, scheme="initial")
+    reopened = Phonebook(directory, storage=storage)
+    assert storage.loaded_shards == []
+    assert [c.name for c in reopened.list_contacts(prefix="B")] == ["Bruno"]
+    assert storage.loaded_shards == [1]
+
+    with reopened.batch():
+        reopened.update_contact(reopened.get_contact(1), name="Abel")
+        reopened.update_contact(reopened.get_contact(4), name="Bob")
+        assert storage.dirty_shards == [0, 1, 2]
+    assert storage.loaded_shards == [0, 1, 2]
+    assert storage.dirty_shards == []
+
+    reference.update_contact(reference.get_contact(1), name="Abel")
+    reference.update_contact(reference.get_contact(4), name="Bob")
+    for query in ["b", "ev", ""]:
+        assert reopened.search_contacts(query) == reference.search_contacts(query)
+    final = Phonebook(directory, storage=ShardedStorage(directory, scheme="initial"))
+    assert list(final.list_contacts()) == list(reference.list_contacts())
+    assert final.contacts == reference.contacts
+
+
+def test_sharded_storage_keeps_its_map_after_in_place_updates(tmp_path):
+    directory = str(tmp_path / "shards")
+    phonebook = Phonebook(directory, storage=ShardedStorage(directory, scheme="initial"))
+    for name in ["Ana", "Bruno", "Carla"]:
+        phonebook.add_contact(Contact(name, "+351911", "x@example.com"))
+    phonebook.delete_contact(phonebook.get_contact(3))
+
+    reopened = Phonebook(directory, storage=ShardedStorage(directory, scheme="initial"))
+    reopened.update_contact(reopened.get_contact(1), email="ana@example.com")
+
+    storage = ShardedStorage(directory, scheme="initial")
+    final = Phonebook(directory, storage=storage)
+    assert storage.loaded_shards == []
+    assert storage.max_id() == 3
+    final.add_contact(Contact("Dora", "+351912", "d@example.com"))
+    assert [(c.id, c.email) for c in final.contacts] == [
+        (1, "ana@example.com"), (2, "x@example.com"), (4, "d@example.com"),
+    ]
+
+
+def test_fuzzy_search_ranks_by_edit_distance(tmp_path):
+    names = ["Ana Silva", "Anna Silva", "Ana Sliva", "Bob", "ANA SILVA"]
+    phonebook = make_phonebook(tmp_path, *(Contact(n, "+351911", "x@example.com") for n in names))
+
+    assert [c.name for c in phonebook.fuzzy_search("ana silva")] == [
+        "Ana Silva", "ANA SILVA", "Anna Silva", "Ana Sliva",
+    ]
+    assert [c.name for c in phonebook.fuzzy_search("ana silva", max_distance=1, limit=3)] == [
+        "Ana Silva", "ANA SILVA", "Anna Silva",
+    ]
+
+    phonebook.update_contact(phonebook.search_contacts("bob")[0], name="Ana Silvia")
+    phonebook.delete_contact(phonebook.search_contacts("anna")[0])
+    assert [c.name for c in phonebook.fuzzy_search("Ana Silvia", max_distance=1)] == ["Ana Silvia", "Ana Silva", "ANA SILVA"]
+
+    filename = str(tmp_path / "contacts.db")
+    on_disk = Phonebook(filename, storage=SqliteStorage(filename))
+    for contact in phonebook.contacts:
+        on_disk.add_contact(replace(contact, id=0))
+    assert [c.name for c in on_disk.fuzzy_search("Ana Silvia", max_distance=1)] == [
+        c.name for c in phonebook.fuzzy_search("Ana Silvia", max_distance=1)
+    ]
+    on_disk.storage.close()
+
+
+def test_phonetic_encodings():
+    assert soundex("Robert") == soundex("Rupert") == "R163"
+    assert soundex("Tymczak") == "T522"
+    assert double_metaphone("Schmidt") == ("XMT", "SMT")
+    assert double_metaphone("Knight") == double_metaphone("Night")
+    assert double_metaphone("Gonçalves") == double_metaphone("Gonzalves")
+
+
+def test_sounds_like_finds_misheard_names(tmp_path):
+    names = ["Catherine Müller", "Philip Smith", "Ana Silva", "Kathryn Mueller"]
+    phonebook = make_phonebook(tmp_path, *(Contact(n, "+351911", "x@example.com") for n in names))
+
+    assert [c.name for c in phonebook.sounds_like("katherine")] == ["Catherine Müller", "Kathryn Mueller"]
+    assert [c.name for c in phonebook.sounds_like("Filip Schmidt")] == ["Philip Smith"]
+    assert phonebook.sounds_like("Zzz") == []
+
+    phonebook.update_contact(phonebook.search_contacts("kathryn")[0], name="Anna Sylva")
+    assert [c.name for c in phonebook.sounds_like("muller")] == ["Catherine Müller"]
+    assert [c.name for c in phonebook.sounds_like("ana silva")] == ["Ana Silva", "Anna Sylva"]
+
+
+def test_find_by_phone_ignores_formatting(tmp_path):
+    assert normalize_phone("0044 (7700) 900-123") == normalize_phone("+44 7700 900123") == "447700900123"
+    phonebook = make_phonebook(
+        tmp_path,
+        Contact("Ana", "+44 7700 900123", "ana@example.com"),
+        Contact("Bob", "+447700900999", "bob@example.com"),
+        Contact("Carla", "+351 911 000", "carla@example.com"),
+    )
+
+    assert [c.name for c in phonebook.find_by_phone("0044 7700-900-123")] == ["Ana"]
+    assert [c.name for c in phonebook.find_by_phone("+44 7700", prefix=True)] == ["Ana", "Bob"]
+
+    phonebook.update_contact(phonebook.search_contacts("bob")[0], phone="+351 911 001")
+    phonebook.delete_contact(phonebook.search_contacts("carla")[0])
+    assert [c.name for c in phonebook.find_by_phone("+447", prefix=True)] == ["Ana"]
+    assert [c.name for c in phonebook.find_by_phone("+351911", prefix=True)] == ["Bob"]
+    assert phonebook.find_by_phone("+351911000") == []
+
+
+def test_sqlite_lookups_run_in_the_database(tmp_path, monkeypatch):
+    filename = str(tmp_path / "contacts.db")
+    on_disk = Phonebook(filename, storage=SqliteStorage(filename))
+    on_disk.add_contact(Contact("Ana", "+44 7700 900123", "ana@example.com", category="Emergency"))
+    on_disk.add_contact(Contact("Bob", "+447700900999", "bob@example.com"))
+    on_disk.add_contact(Contact("Carla", "+351 911 000", "carla@example.com", category="Emergency"))
+    monkeypatch.setattr(SqliteStorage, "load_rows", None)
+
+    assert [c.name for c in on_disk.find_by_phone("0044 7700-900-123")] == ["Ana"]
+    assert [c.name for c in on_disk.find_by_phone("+44 7700", prefix=True)] == ["Ana", "Bob"]
+    assert [c.name for c in on_disk.filter_contacts(category="Emergency")] == ["Ana", "Carla"]
+    assert [c.name for c in on_disk.filter_contacts("UK", "Emergency")] == ["Ana"]
+    assert on_disk.facet_counts() == {
+        "country": {"UK": 2, "Portugal": 1}, "category": {"Emergency": 2, "General": 1},
+    }
+    on_disk.storage.close()
+
+
+def test_filter_and_facet_counts_follow_mutations(tmp_path):
+    phonebook = make_phonebook(
+        tmp_path,
+        Contact("Ana", "+351911", "a@example.com", category="Emergency"),
+        Contact("Bob", "+351912", "b@example.com", category="Emergency"),
+        Contact("Carla", "+4412", "c@example.com", category="Emergency"),
+        Contact("Dan", "+351913", "d@example.com"),
+    )
+    assert [c.name for c in phonebook.filter_contacts("Portugal", "Emergency")] == ["Ana", "Bob"]
+    assert phonebook.facet_counts() == {
+        "country": {"Portugal": 3, "UK": 1}, "category": {"Emergency": 3, "General": 1},
+    }
+
+    phonebook.update_contact(phonebook.search_contacts("bob")[0], phone="+4477")
+    phonebook.delete_contact(phonebook.search_contacts("dan")[0])
+    phonebook.add_contact(Contact("Eva", "+33123", "e@example.com", category="Family"))
+    assert [c.name for c in phonebook.filter_contacts(category="Emergency")] == ["Ana", "Bob", "Carla"]
+    assert [c.name for c in phonebook.filter_contacts(country="UK")] == ["Bob", "Carla"]
+    assert phonebook.facet_counts()["country"] == {"UK": 2, "France": 1, "Portugal": 1}
+
+    filename = str(tmp_path / "contacts.db")
+    on_disk = Phonebook(filename, storage=SqliteStorage(filename))
+    for contact in phonebook.contacts:
+        on_disk.add_contact(replace(contact, id=0))
+    assert on_disk.facet_counts() == phonebook.facet_counts()
+    assert [c.name for c in on_disk.filter_contacts("UK", "Emergency")] == [
+        c.name for c in phonebook.filter_contacts("UK", "Emergency")
+    ]
+    on_disk.storage.close()
+
+
+def test_search_cache_hits_until_a_mutation(tmp_path):
+    phonebook = make_phonebook(tmp_path, Contact("Ana", "+351911", "a@example.com"))
+    phonebook.search_contacts("an")
+    assert [c.name for c in phonebook.search_contacts("AN")] == ["Ana"]
+    assert (phonebook.search_cache.hits, phonebook.search_cache.misses) == (1, 1)
+
+    phonebook.add_contact(Contact("Joana", "+351912", "j@example.com"))
+    assert len(phonebook.search_cache) == 0
+    assert [c.name for c in phonebook.search_contacts("an")] == ["Ana", "Joana"]
+    phonebook.update_contact(phonebook.search_contacts("joana")[0], name="Bob")
+    assert [c.name for c in phonebook.search_contacts("an")] == ["Ana"]
+    assert (phonebook.search_cache.hits, phonebook.search_cache.misses) == (1, 4)
+
+
+def test_search_ignores_case_accents_and_spacing(tmp_path):
+    names = ["Jürgen  Müller", "Ana Silva", "STRAẞE Bäcker"]
+    for columnar in (False, True):
+        phonebook = Phonebook(str(tmp_path / f"contacts_{columnar}.csv"), columnar=columnar, trigram_index=True)
+        for name in names:
+            phonebook.add_contact(Contact(name, "+351911", "x@example.com"))
+        assert [c.name for c in phonebook.search_contacts("MULLER")] == ["Jürgen  Müller"]
+        assert [c.name for c in phonebook.search_contacts("jurgen mul")] == ["Jürgen  Müller"]
+        assert [c.name for c in phonebook.search_contacts("strasse")] == ["STRAẞE Bäcker"]
+
+        phonebook.update_contact(phonebook.search_contacts("silva")[0], name="Zoë")
+        assert phonebook.get_contact(2).search_key == "zoe"
+        assert [c.name for c in phonebook.search_contacts("ZOE")] == ["Zoë"]
+
+    filename = str(tmp_path / "contacts.db")
+    on_disk = Phonebook(filename, storage=SqliteStorage(filename))
+    on_disk.add_contact(Contact("Jürgen Müller", "+351911", "x@example.com"))
+    assert [c.name for c in on_disk.search_contacts("muller")] == ["Jürgen Müller"]
+    on_disk.storage.close()
+
+
+def test_packed_search_matches_linear_search(tmp_path):
+    packed = Phonebook(str(tmp_path / "packed.csv"), packed_search=True)
+    plain = Phonebook(str(tmp_path / "plain.csv"))
+    for phonebook in (packed, plain):
+        with phonebook.batch():
+            for i in range(150):
+                phonebook.add_contact(Contact(f"Person {i} Müller", "+351911", "p@example.com"))
+            for contact in phonebook.contacts[:100]:
+                phonebook.delete_contact(contact)
+            phonebook.update_contact(phonebook.get_contact(120), name="Zoë Anna")
+            phonebook.update_contact(phonebook.get_contact(110), name="Person 110 Zoe")
+
+    for query in ["", "e", "son 1", "MULLER", "zoe", "14", "zzz"]:
+        expected = [c.id for c in plain.search_contacts(query)]
+        assert [c.id for c in packed.search_contacts(query)] == expected
+        assert [c.id for c in packed.iter_search(query)] == expected
+
+    # Enough replacements force a repack, which must keep the same order.
+    with packed.batch():
+        for contact_id in range(101, 151):
+            packed.update_contact(packed.get_contact(contact_id), name=f"Renamed {contact_id}")
+    assert [c.id for c in packed.search_contacts("renamed")] == list(range(101, 151))
+
+
+def test_iter_search_pages_match_search_contacts(tmp_path):
+    filename = str(tmp_path / "contacts.db")
+    books = [
+        Phonebook(str(tmp_path / "plain.csv")),
+        Phonebook(str(tmp_path / "trigram.csv"), trigram_index=True),
+        Phonebook(str(tmp_path / "packed.csv"), packed_search=True),
+        Phonebook(filename, storage=SqliteStorage(filename)),
+    ]
+    for phonebook in books:
+        with phonebook.batch():
+            for i in range(30):
+                phonebook.add_contact(Contact(f"Ana {i}" if i % 2 else f"Bruno {i}", "+351911", "p@example.com"))
+
+        for query in ["ana", "an", "bruno 2", "zzz"]:
+            expected = [c.id for c in phonebook.search_contacts(query)]
+            assert [c.id for c in phonebook.iter_search(query)] == expected
+            assert [c.id for c in phonebook.iter_search(query, limit=4, offset=3)] == expected[3:7]
+            first = phonebook.first_match(query)
+            assert (first and first.id) == (expected[0] if expected else None)
+
+    phonebook = books[0]
+    phonebook.add_contact(Contact("Anabela", "+351912", "a@example.com"))
+    assert phonebook.first_match("anabela").name == "Anabela"
+    phonebook.search_contacts("ana")
+    counts = (phonebook.search_cache.hits, phonebook.search_cache.misses)
+    assert [c.name for c in phonebook.iter_search("ANA", limit=2)] == ["Ana 1", "Ana 3"]
+    assert phonebook.first_match("bruno").name == "Bruno 0"
+    assert (phonebook.search_cache.hits, phonebook.search_cache.misses) == counts
+    books[3].storage.close()
+
+
+def test_find_duplicates_clusters_and_merges(tmp_path):
+    phonebook = make_phonebook(
+        tmp_path,
+        Contact("Ana Silva", "+351 912 345 678", ""),
+        Contact("Bruno Costa", "+351913000000", "bruno@example.com"),
+        Contact("ANA  SILVA", "912345678", "ana@example.com"),
+        Contact("Jon Smith", "+4420700000", "jsmith@example.com"),
+        Contact("John Smith", "+4420711111", "JSmith@example.com"),
+        Contact("Ana Silva", "+351960000000", "other@example.com"),
+        Contact("Bruno Costa", "+351913000000", "", category="Work"),
+    )
+    report = phonebook.find_duplicates()
+    assert report.clusters == [(1, 3), (2, 7), (4, 5)]
+    assert report.compared < 7 * 6 // 2
+
+    assert phonebook.merge_duplicates(report.clusters) == 3
+    assert [c.id for c in phonebook.contacts] == [1, 2, 4, 6]
+    assert phonebook.get_contact(1).email == "ana@example.com"
+    assert phonebook.find_duplicates().clusters == []
+
+
+def test_scan_contacts_keeps_order_across_workers(tmp_path):
+    phonebook = make_phonebook(tmp_path, *(
+        Contact(f"Person {i}", "+351911" if i % 3 else "+4412", f"p{i}@example.com") for i in range(100)
+    ))
+    predicate = field_matches(r"^person \d*7$")
+    expected = [c for c in phonebook.contacts if c.name.endswith("7")]
+
+    assert phonebook.scan_contacts(predicate) == expected
+    assert phonebook.scan_contacts(predicate, workers=3, partition_size=7) == expected
+    assert phonebook.scan_contacts(predicate, limit=4, workers=2, processes=True, partition_size=9) == expected[:4]
+    assert [c.country for c in phonebook.scan_contacts(field_matches("UK", "country"), limit=2)] == ["UK", "UK"]
+
+
+def test_query_language_uses_indexes_and_matches_scan(tmp_path):
+    phonebook = Phonebook(str(tmp_path / "contacts.csv"), trigram_index=True)
+    people = [
+        ("Ana Silva", "+351 911", "Emergency"), ("Bruno Sá", "+351912", "Family"),
+        ("Anabela", "+44 7700", "Emergency"), ("Carla", "+4412", "General"), ("Joana", "+351913", "Emergency"),
+    ]
+    for name, phone, category in people:
+        phonebook.add_contact(Contact(name, phone, "x@example.com", category=category))
+
+    def names(text):
+        return [c.name for c in phonebook.query(text)]
+
+    assert names('category = emergency AND country = "PORTUGAL"') == ["Ana Silva", "Joana"]
+    assert names("name ~ ana AND NOT phone ^= +44 ORDER BY name DESC") == ["Joana", "Ana Silva"]
+    assert names("(name STARTS WITH bru OR phone = '00447700') AND country != Portugal") == ["Anabela"]
+    assert names("name contains sa or category = general limit 2") == ["Bruno Sá", "Carla"]
+    assert names("ORDER BY phone DESC LIMIT 1") == ["Anabela"]
+
+    plan = phonebook.explain("category = Emergency AND name CONTAINS 'bela' LIMIT 1")
+    assert "Index trigram on name CONTAINS 'bela' (est. 1 rows)" in plan
+    assert "Scan" in phonebook.explain("NOT name ~ ana")
+    for bad in ["name", "name ~", "age = 3", "name = a LIMIT x", "(name = a", "name LIKE a"]:
+        with pytest.raises(QuerySyntaxError):
+            phonebook.query(bad)
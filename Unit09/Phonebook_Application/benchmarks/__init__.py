@@ -0,0 +1,7 @@
+"""Benchmarks for the PhoneBook application (run with: python -m benchmarks)"""
+
+import os
+import sys
+
+# The application is a set of plain scripts in ../app rather than a package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
@@ -0,0 +1,144 @@
+"""
+Times how the Phonebook scales: cold load, Contact construction, search
+latency, mutation throughput, save time and file size.
+
+    python -m benchmarks --sizes 1000 10000 100000 --output results.json
+    python -m benchmarks --sizes 1000 --compare results.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from app import Contact, Phonebook
+from indexes import LRUCache
+from benchmarks.generator import generate_rows, sample_queries, write_csv
+
+
+def measure(size: int, queries: int, mutations: int, workdir: str, **options) -> Dict[str, float]:
+    """Runs every benchmark for one book size and returns the metrics."""
+    path = os.path.join(workdir, f"contacts_{size}.csv")
+    write_csv(path, size)
+    result = {"size": size, "file_size_bytes": os.path.getsize(path)}
+
+    rows = [{**row, "id": str(row["id"])} for _, row in zip(range(100_000), generate_rows(size))]
+    started = time.perf_counter()
+    for row in rows:
+        Contact(**row)
+    result["contact_init_us"] = (time.perf_counter() - started) / len(rows) * 1e6
+    del rows
+
+    gc.collect()
+    started = time.perf_counter()
+    # The search cache stays off so latencies measure real searches and
+    # remain comparable with runs from before the cache existed.
+    phonebook = Phonebook(path, search_cache_size=0, **options)
+    result["cold_load_s"] = time.perf_counter() - started
+
+    latencies = []
+    for query in sample_queries(queries):
+        started = time.perf_counter()
+        phonebook.search_contacts(query)
+        latencies.append((time.perf_counter() - started) * 1e3)
+    cuts = statistics.quantiles(latencies, n=100)
+    result.update(search_p50_ms=cuts[49], search_p95_ms=cuts[94], search_p99_ms=cuts[98])
+
+    # Cache hits are timed on their own, after one pass has warmed the cache.
+    phonebook.search_cache = LRUCache(queries)
+    for query in sample_queries(queries):
+        phonebook.search_contacts(query)
+    latencies = []
+    for query in sample_queries(queries):
+        started = time.perf_counter()
+        phonebook.search_contacts(query)
+        latencies.append((time.perf_counter() - started) * 1e3)
+    result["cached_search_p50_ms"] = statistics.median(latencies)
+
+    new_rows = list(generate_rows(mutations, seed=size))
+    started = time.perf_counter()
+    with phonebook.batch():
+        added = []
+        for row in new_rows:
+            contact = Contact(row["name"], row["phone"], row["email"], category=row["category"])
+            phonebook.add_contact(contact)
+            added.append(contact)
+        for contact in added:
+            phonebook.update_contact(contact, name=contact.name + " Jr")
+        for contact in added:
+            phonebook.delete_contact(contact)
+        result["mutations_per_s"] = 3 * mutations / (time.perf_counter() - started)
+        started = time.perf_counter()
+    # Leaving the batch writes the single deferred snapshot.
+    result["save_s"] = time.perf_counter() - started
+    os.remove(path)
+    return result
+
+
+def compare(current: List[dict], baseline: List[dict]):
+    """Prints each metric as a ratio of the baseline run for matching sizes."""
+    previous = {entry["size"]: entry for entry in baseline}
+    for entry in current:
+        old = previous.get(entry["size"])
+        if not old:
+            continue
+        for metric, value in entry.items():
+            if metric != "size" and old.get(metric):
+                print(f"{entry['size']:>10} {metric:<18} {value / old[metric]:6.2f}x")
+
+
+def main(argv: List[str] = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200, help="searches timed per size")
+    parser.add_argument("--mutations", type=int, default=1_000, help="adds, updates and deletes per size")
+    parser.add_argument("--trigram-index", action="store_true", help="benchmark with the trigram index")
+    parser.add_argument("--packed-search", action="store_true", help="benchmark with the packed name buffer")
+    parser.add_argument("--load-workers", type=int, default=0, help="processes used to parse the CSV")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="print ratios against a previous JSON results file")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            result = measure(size, args.queries, args.mutations, workdir,
+                             trigram_index=args.trigram_index, load_workers=args.load_workers,
+                             packed_search=args.packed_search)
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "options": {
+                "trigram_index": args.trigram_index,
+                "load_workers": args.load_workers,
+                "packed_search": args.packed_search,
+            },
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, mode="w", encoding="UTF-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, mode="r", encoding="UTF-8") as file:
+            compare(results, json.load(file)["results"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
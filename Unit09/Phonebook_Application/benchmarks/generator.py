@@ -0,0 +1,62 @@
+"""Deterministic synthetic contacts for benchmarking"""
+
+import csv
+import random
+from typing import Dict, Iterator
+
+from app import COUNTRY_CODES, VALID_CATEGORIES, lookup_country
+from storage import CONTACT_FIELDS
+
+FIRST_NAMES = [
+    "Ana", "Bruno", "Carla", "Daniel", "Eva", "Filipe", "Grace", "Hugo", "Ines", "Joao",
+    "Karen", "Luis", "Maria", "Nuno", "Olivia", "Pedro", "Quentin", "Rita", "Sofia", "Tiago",
+    "Uma", "Vasco", "Wei", "Xavier", "Yara", "Zoe", "Mohammed", "Priya", "Kenji", "Amara",
+]
+LAST_NAMES = [
+    "Silva", "Santos", "Ferreira", "Pereira", "Oliveira", "Costa", "Rodrigues", "Martins",
+    "Smith", "Jones", "Williams", "Brown", "Muller", "Schmidt", "Rossi", "Garcia", "Dubois",
+    "Kowalski", "Nguyen", "Tanaka", "Kim", "Patel", "Okafor", "Haddad", "Ivanova", "Jensen",
+]
+DOMAINS = ["example.com", "mail.test", "inbox.test", "post.example.org"]
+
+
+def generate_rows(count: int, seed: int = 42) -> Iterator[Dict[str, str]]:
+    """
+    Yields 'count' realistic contact rows, identical for the same seed.
+
+    Phone prefixes are drawn from COUNTRY_CODES and categories from
+    VALID_CATEGORIES, so loading exercises the same code paths as real data.
+    """
+    rng = random.Random(seed)
+    codes = list(COUNTRY_CODES)
+    for contact_id in range(1, count + 1):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        phone = rng.choice(codes) + "".join(rng.choice("0123456789") for _ in range(9))
+        yield {
+            "id": contact_id,
+            "name": f"{first} {last}",
+            "phone": phone,
+            "country": lookup_country(phone),
+            "email": f"{first.lower()}.{last.lower()}{contact_id}@{rng.choice(DOMAINS)}",
+            "category": rng.choice(VALID_CATEGORIES),
+        }
+
+
+def write_csv(path: str, count: int, seed: int = 42):
+    """Writes a contacts.csv with 'count' generated rows."""
+    with open(path, mode="w", newline="", encoding="UTF-8") as file:
+        writer = csv.DictWriter(file, fieldnames=CONTACT_FIELDS)
+        writer.writeheader()
+        writer.writerows(generate_rows(count, seed))
+
+
+def sample_queries(count: int, seed: int = 7) -> list:
+    """Returns name fragments of mixed length and selectivity for search timing."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        name = rng.choice(FIRST_NAMES + LAST_NAMES).lower()
+        start = rng.randrange(len(name) - 2)
+        queries.append(name[start:start + rng.randint(3, len(name) - start)])
+    return queries